@@ -1,6 +1,6 @@
 # chatbot/admin.py
 from django.contrib import admin
-from .models import ChatSession, Message
+from .models import ChatSession, IdempotencyKey, Message, PainScaleRollup
 
 class MessageInline(admin.TabularInline):
     """Tabular Inline View for Message"""
@@ -28,5 +28,23 @@ class MessageAdmin(admin.ModelAdmin):
         return obj.text[:50] + '...' if len(obj.text) > 50 else obj.text
     text_preview.short_description = 'Text Preview'
 
+class PainScaleRollupAdmin(admin.ModelAdmin):
+    """Admin View for PainScaleRollup"""
+    list_display = ('id', 'user', 'day', 'message_count', 'session_count', 'pain_min', 'pain_max', 'pain_avg')
+    list_filter = ('day',)
+    search_fields = ('user__username', 'user__email')
+    date_hierarchy = 'day'
+    readonly_fields = ('user', 'day', 'message_count', 'session_count', 'pain_count',
+                       'pain_sum', 'pain_min', 'pain_max')
+
+class IdempotencyKeyAdmin(admin.ModelAdmin):
+    """Admin View for IdempotencyKey"""
+    list_display = ('id', 'user', 'key', 'chat_session', 'created_at')
+    search_fields = ('key', 'user__username')
+    date_hierarchy = 'created_at'
+    raw_id_fields = ('chat_session', 'user_message', 'bot_message')
+
 admin.site.register(ChatSession, ChatSessionAdmin)
-admin.site.register(Message, MessageAdmin)
\ No newline at end of file
+admin.site.register(Message, MessageAdmin)
+admin.site.register(PainScaleRollup, PainScaleRollupAdmin)
+admin.site.register(IdempotencyKey, IdempotencyKeyAdmin)
\ No newline at end of file
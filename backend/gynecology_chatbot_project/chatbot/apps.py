@@ -0,0 +1,12 @@
+# chatbot/apps.py
+
+from django.apps import AppConfig
+
+
+class ChatbotConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'chatbot'
+    
+    def ready(self):
+        # Register signal handlers and system checks
+        from . import checks, signals  # noqa: F401
@@ -0,0 +1,30 @@
+# chatbot/checks.py
+
+from django.conf import settings
+from django.core.checks import Warning, register
+from .sharding import sharding_enabled
+
+# Cache backends that are not shared between processes
+LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register()
+def check_shared_cache(app_configs, **kwargs):
+    """Shard moves and read-your-writes pins reach other processes only through a shared cache"""
+    if not sharding_enabled() and not settings.DATABASE_REPLICAS:
+        return []
+    if settings.CACHES['default']['BACKEND'] not in LOCAL_CACHE_BACKENDS:
+        return []
+    return [
+        Warning(
+            'Chat shards or read replicas are configured with a per-process cache.',
+            hint=(
+                'Set REDIS_URL so shard moves and replica pins reach every app server; '
+                'otherwise reads can be served by a stale shard or a lagging replica.'
+            ),
+            id='chatbot.W001',
+        )
+    ]
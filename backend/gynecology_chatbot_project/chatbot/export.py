@@ -0,0 +1,123 @@
+# chatbot/export.py
+
+import zipfile
+from gynecology_chatbot_project.renderers import ORJSONRenderer
+from .models import ChatSession, Message
+from .serializers import ChatSessionValuesSerializer, MessageValuesSerializer
+from .sharding import on_user_shard
+
+SESSION_FIELDS = [field for field in ChatSessionValuesSerializer.fields if field != 'user']
+
+
+class ZipStreamBuffer:
+    """
+    Write-only file object for ZipFile that hands written bytes back to the
+    caller. It reports its position but cannot seek, so ZipFile writes each
+    entry in streaming mode with sizes after the data.
+    """
+    
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+    
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+    
+    def tell(self):
+        return self.position
+    
+    def flush(self):
+        pass
+    
+    def read(self):
+        """Return and forget everything written since the last read"""
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def parse_cursor(value):
+    """
+    Parse an export cursor of the form '<session id>:<message id>'.
+    Raises ValueError if the cursor is malformed.
+    """
+    session_id, _, message_id = value.partition(':')
+    return int(session_id), int(message_id or 0)
+
+
+def export_records(user, cursor=None, chunk_size=1000):
+    """
+    Yield a user's chat archive as flat records, ordered by session and then
+    message id. Each record carries the cursor to resume right after it.
+    Rows are streamed with iterator(), so memory use does not depend on the
+    size of the archive.
+    """
+    after_session, after_message = cursor or (0, 0)
+    sessions = (
+        on_user_shard(ChatSession.objects, user)
+        .filter(user=user, id__gte=after_session)
+        .order_by('id')
+        .values(*SESSION_FIELDS)
+    )
+    
+    for session in sessions.iterator(chunk_size=chunk_size):
+        messages = (
+            Message.objects
+            .using(sessions.db)
+            .filter(chat_session_id=session['id'])
+            .order_by('id')
+        )
+        
+        if session['id'] == after_session:
+            # The session header was already delivered before the cursor
+            messages = messages.filter(id__gt=after_message)
+        else:
+            yield {'type': 'session', 'cursor': f"{session['id']}:0", **session}
+        
+        for message in messages.values(*MessageValuesSerializer.fields).iterator(chunk_size=chunk_size):
+            yield {
+                'type': 'message',
+                'cursor': f"{session['id']}:{message['id']}",
+                'session': session['id'],
+                **message
+            }
+
+
+def stream_ndjson(records):
+    """Encode records as newline-delimited JSON"""
+    renderer = ORJSONRenderer()
+    for record in records:
+        yield renderer.render(record) + b'\n'
+
+
+def stream_zip(records):
+    """
+    Encode records as a zip archive with one NDJSON file per chat session,
+    yielding compressed bytes as soon as they are produced.
+    """
+    renderer = ORJSONRenderer()
+    buffer = ZipStreamBuffer()
+    
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        entry = None
+        current_session = None
+        
+        for record in records:
+            session_id = record['session'] if record['type'] == 'message' else record['id']
+            if session_id != current_session:
+                if entry:
+                    entry.close()
+                entry = archive.open(f'session-{session_id}.ndjson', 'w', force_zip64=True)
+                current_session = session_id
+            
+            entry.write(renderer.render(record) + b'\n')
+            data = buffer.read()
+            if data:
+                yield data
+        
+        if entry:
+            entry.close()
+    
+    yield buffer.read()
@@ -0,0 +1,110 @@
+# chatbot/idempotency.py
+
+import hashlib
+import json
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from .models import IdempotencyKey
+from .sharding import shard_for_user
+from .singleflight import SingleFlight
+
+# Coalesces identical send_message requests that are in flight in this process
+send_message_flights = SingleFlight()
+
+# How often a request waits between checks on a key held by another process
+POLL_INTERVAL_SECONDS = 0.25
+
+KEY_MAX_LENGTH = IdempotencyKey._meta.get_field('key').max_length
+
+
+class IdempotencyConflict(Exception):
+    """Raised when an idempotency key cannot be used for the current request"""
+    
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def request_hash(chat_session, text, pain_scale):
+    """Return a fingerprint of a send_message payload"""
+    payload = json.dumps([chat_session.id, text, pain_scale], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def claim_key(user, key, chat_session, payload_hash):
+    """
+    Claim an idempotency key for this request. Returns (record, created);
+    created is False when an earlier request already holds the key. A key
+    taken over from an abandoned request keeps its user message, if saved.
+    """
+    # Keys live on the user's chat shard, next to the messages they point to
+    using = shard_for_user(user, for_write=True)
+    try:
+        with transaction.atomic(using=using):
+            return IdempotencyKey.objects.using(using).create(
+                user=user,
+                key=key,
+                chat_session=chat_session,
+                request_hash=payload_hash
+            ), True
+    except IntegrityError:
+        pass
+    
+    record = IdempotencyKey.objects.using(using).filter(user=user, key=key).first()
+    if record is None:
+        # The holder failed and released the key in the meantime
+        return claim_key(user, key, chat_session, payload_hash)
+    
+    expiry = timezone.now() - timedelta(hours=settings.IDEMPOTENCY_KEY_TTL_HOURS)
+    if record.created_at < expiry:
+        record.delete()
+        return claim_key(user, key, chat_session, payload_hash)
+    
+    if record.request_hash != payload_hash:
+        raise IdempotencyConflict(
+            'Idempotency-Key was already used for a different request',
+            status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+    
+    abandoned = timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_WAIT_SECONDS)
+    if not record.is_complete and record.created_at < abandoned:
+        # The holder never finished or released the key, e.g. its worker was
+        # killed mid-request; take it over, unless another retry got there first
+        claimed_at = timezone.now()
+        taken = IdempotencyKey.objects.using(using).filter(
+            pk=record.pk, created_at=record.created_at, bot_message__isnull=True
+        ).update(created_at=claimed_at)
+        if not taken:
+            return claim_key(user, key, chat_session, payload_hash)
+        record.created_at = claimed_at
+        return record, True
+    return record, False
+
+
+def wait_for_result(record):
+    """
+    Wait for the request holding a key in another process to finish and
+    return the completed record, or None if it failed or took too long.
+    """
+    deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_SECONDS
+    while not record.is_complete:
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(POLL_INTERVAL_SECONDS)
+        record = IdempotencyKey.objects.using(record._state.db).filter(pk=record.pk).first()
+        if record is None:
+            return None
+    return record
+
+
+def purge_expired_keys():
+    """Delete idempotency keys older than IDEMPOTENCY_KEY_TTL_HOURS on every shard"""
+    expiry = timezone.now() - timedelta(hours=settings.IDEMPOTENCY_KEY_TTL_HOURS)
+    deleted = 0
+    for alias in settings.CHAT_SHARDS:
+        deleted += IdempotencyKey.objects.using(alias).filter(created_at__lt=expiry).delete()[0]
+    return deleted
@@ -0,0 +1,312 @@
+# chatbot/importer.py
+
+import json
+import time
+from collections import defaultdict
+from django.db import transaction
+from django.db.models import F, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from doctors.triage import rebuild_entries
+from users.models import User
+from .models import ChatSession, Message
+from .rollups import rebuild_rollups
+from .sharding import shard_for_user
+
+try:
+    import orjson
+    loads = orjson.loads
+except ImportError:  # orjson is optional; fall back to the stdlib json module
+    loads = json.loads
+
+MESSAGE_TYPES = {choice for choice, _ in Message.MESSAGE_TYPE_CHOICES}
+PROVIDER_MAX_LENGTH = Message._meta.get_field('ai_provider').max_length
+TITLE_MAX_LENGTH = ChatSession._meta.get_field('title').max_length
+
+# Number of errors kept for the report; the rest are only counted
+MAX_REPORTED_ERRORS = 100
+
+
+class ImportRecordError(ValueError):
+    """Raised when an import record is invalid"""
+
+
+def is_source_id(value):
+    """Source session ids may be integers or strings"""
+    return isinstance(value, (int, str)) and not isinstance(value, bool)
+
+
+class ChatImporter:
+    """
+    Bulk import chat sessions and messages from NDJSON, in the record format
+    produced by the chat export (see chatbot/export.py):
+
+        {"type": "session", "id": 17, "user": "alice", "title": "...", "created_at": "..."}
+        {"type": "message", "session": 17, "message_type": "user", "text": "...",
+         "timestamp": "...", "pain_scale": 4, "ai_provider": ""}
+    
+    Session ids are the ids in the source system; messages refer to them and
+    must come after their session. Records are validated and written in chunks
+    with bulk_create, one transaction per chunk and chat shard. Invalid
+    records are skipped and reported rather than aborting the import.
+    """
+    
+    def __init__(self, default_user=None, chunk_size=5000, progress=None):
+        self.default_user = default_user
+        self.chunk_size = chunk_size
+        self.progress = progress
+        # Source session id -> (new session id, shard alias)
+        self.session_map = {}
+        self.user_ids = {}
+        # User id -> shard alias, looked up once per import
+        self.shards = {}
+        # Shard alias -> ids of the users whose data was imported there
+        self.imported_user_ids = defaultdict(set)
+        # Range of imported message times, to limit the rollup rebuild
+        self.first_timestamp = None
+        self.last_timestamp = None
+        self.session_count = 0
+        self.message_count = 0
+        self.error_count = 0
+        self.errors = []
+        self.started = None
+    
+    def run(self, lines):
+        """Import an iterable of NDJSON lines and return a summary"""
+        self.started = time.monotonic()
+        chunk = []
+        
+        for line_number, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = loads(line)
+                if not isinstance(record, dict):
+                    raise ImportRecordError("Record must be a JSON object")
+            except ValueError as exc:
+                self.add_error(line_number, exc)
+                continue
+            
+            chunk.append((line_number, record))
+            if len(chunk) >= self.chunk_size:
+                self.import_chunk(chunk)
+                chunk = []
+        
+        if chunk:
+            self.import_chunk(chunk)
+        
+        self.finish()
+        return self.summary()
+    
+    def import_chunk(self, chunk):
+        """Validate a chunk of records and write it, one transaction per shard"""
+        self.resolve_users(
+            record.get('user') for _, record in chunk
+            if record.get('type') == 'session' and isinstance(record.get('user'), str)
+        )
+        
+        # Sessions from this chunk by source id, until they have been written
+        pending = {}
+        for line_number, record in chunk:
+            if record.get('type') != 'session':
+                continue
+            try:
+                pending[record.get('id')] = self.build_session(record, pending)
+            except ImportRecordError as exc:
+                self.add_error(line_number, exc)
+        
+        sessions_by_shard = defaultdict(list)
+        for session in pending.values():
+            sessions_by_shard[self.shard_for_user(session.user_id)].append(session)
+        
+        messages_by_shard = defaultdict(list)
+        for line_number, record in chunk:
+            if record.get('type') == 'session':
+                continue
+            try:
+                alias, message, session = self.build_message(record, pending)
+            except ImportRecordError as exc:
+                self.add_error(line_number, exc)
+                continue
+            messages_by_shard[alias].append((message, session))
+        
+        for alias in sessions_by_shard.keys() | messages_by_shard.keys():
+            with transaction.atomic(using=alias):
+                ChatSession.objects.using(alias).bulk_create(sessions_by_shard[alias])
+                for message, session in messages_by_shard[alias]:
+                    if session is not None:
+                        message.chat_session_id = session.id
+                Message.objects.using(alias).bulk_create(
+                    [message for message, _ in messages_by_shard[alias]],
+                    batch_size=self.chunk_size
+                )
+            
+            for session in sessions_by_shard[alias]:
+                self.imported_user_ids[alias].add(session.user_id)
+        
+        for source_id, session in pending.items():
+            self.session_map[source_id] = (session.id, session._state.db)
+        
+        messages = [message for shard in messages_by_shard.values() for message, _ in shard]
+        if messages:
+            timestamps = [message.timestamp for message in messages]
+            self.first_timestamp = min(timestamps + [self.first_timestamp or timestamps[0]])
+            self.last_timestamp = max(timestamps + [self.last_timestamp or timestamps[0]])
+        
+        self.session_count += len(pending)
+        self.message_count += len(messages)
+        if self.progress:
+            self.progress(self.summary())
+    
+    def resolve_users(self, usernames):
+        """Look up the ids of all usernames in a chunk with a single query"""
+        missing = set(usernames) - set(self.user_ids)
+        if missing:
+            self.user_ids.update(
+                User.objects.filter(username__in=missing).values_list('username', 'id')
+            )
+    
+    def shard_for_user(self, user_id):
+        if user_id not in self.shards:
+            self.shards[user_id] = shard_for_user(user_id, for_write=True)
+        return self.shards[user_id]
+    
+    def build_session(self, record, pending):
+        if record.get('id') is None:
+            raise ImportRecordError("Session record has no id")
+        if not is_source_id(record['id']):
+            raise ImportRecordError("Session id must be an integer or a string")
+        if record['id'] in self.session_map or record['id'] in pending:
+            raise ImportRecordError(f"Duplicate session id {record['id']}")
+        
+        username = record.get('user')
+        if username is not None and not isinstance(username, str):
+            raise ImportRecordError("user must be a username")
+        if username:
+            user_id = self.user_ids.get(username)
+            if user_id is None:
+                raise ImportRecordError(f"Unknown user '{username}'")
+        elif self.default_user:
+            user_id = self.default_user.id
+        else:
+            raise ImportRecordError("Session record has no user")
+        
+        title = record.get('title') or ''
+        if not isinstance(title, str) or len(title) > TITLE_MAX_LENGTH:
+            raise ImportRecordError(f"title must be a string of at most {TITLE_MAX_LENGTH} characters")
+        
+        session = ChatSession(user_id=user_id, title=title)
+        if record.get('created_at'):
+            session.created_at = self.parse_timestamp(record['created_at'], 'created_at')
+        return session
+    
+    def build_message(self, record, pending):
+        """
+        Return (shard alias, message, pending session); the pending session is
+        None when the message belongs to a session written in an earlier chunk
+        """
+        if record.get('type') != 'message':
+            raise ImportRecordError(f"Unknown record type {record.get('type')!r}")
+        
+        if record.get('session') is None:
+            raise ImportRecordError("Message record has no session")
+        if not is_source_id(record['session']):
+            raise ImportRecordError("Message session must be an integer or a string")
+        
+        session = pending.get(record.get('session'))
+        if session is not None:
+            alias, session_id = self.shard_for_user(session.user_id), None
+        elif record.get('session') in self.session_map:
+            session_id, alias = self.session_map[record['session']]
+        else:
+            raise ImportRecordError(f"Message refers to unknown session {record.get('session')!r}")
+        
+        message_type = record.get('message_type')
+        if not isinstance(message_type, str) or message_type not in MESSAGE_TYPES:
+            raise ImportRecordError(f"message_type must be one of {sorted(MESSAGE_TYPES)}")
+        
+        text = record.get('text')
+        if not text or not isinstance(text, str):
+            raise ImportRecordError("Message text is required")
+        
+        pain_scale = record.get('pain_scale')
+        if pain_scale is not None and (
+            not isinstance(pain_scale, int) or isinstance(pain_scale, bool)
+            or not 0 <= pain_scale <= 10
+        ):
+            raise ImportRecordError("pain_scale must be an integer from 0 to 10")
+        
+        ai_provider = record.get('ai_provider') or ''
+        if not isinstance(ai_provider, str) or len(ai_provider) > PROVIDER_MAX_LENGTH:
+            raise ImportRecordError(f"ai_provider must be a string of at most {PROVIDER_MAX_LENGTH} characters")
+        
+        return alias, Message(
+            chat_session_id=session_id,
+            message_type=message_type,
+            text=text,
+            timestamp=self.parse_timestamp(record.get('timestamp'), 'timestamp'),
+            pain_scale=pain_scale,
+            ai_provider=ai_provider,
+        ), session
+    
+    def parse_timestamp(self, value, field):
+        try:
+            parsed = parse_datetime(value) if isinstance(value, str) else None
+        except ValueError:
+            parsed = None
+        if parsed is None:
+            raise ImportRecordError(f"{field} must be an ISO 8601 datetime")
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed
+    
+    def finish(self):
+        """Set session update times from their messages and rebuild rollups and triage entries"""
+        session_ids_by_shard = defaultdict(list)
+        for session_id, alias in self.session_map.values():
+            session_ids_by_shard[alias].append(session_id)
+        
+        last_message = (
+            Message.objects
+            .filter(chat_session=OuterRef('pk'))
+            .values('chat_session')
+            .annotate(last=Max('timestamp'))
+            .values('last')
+        )
+        for alias, session_ids in session_ids_by_shard.items():
+            for start in range(0, len(session_ids), self.chunk_size):
+                # update() bypasses auto_now, so updated_at reflects the imported history
+                ChatSession.objects.using(alias).filter(
+                    id__in=session_ids[start:start + self.chunk_size]
+                ).update(updated_at=Coalesce(Subquery(last_message), F('created_at')))
+        
+        # bulk_create skips the post_save signal that maintains the pain rollups
+        if self.first_timestamp:
+            for alias, user_ids in self.imported_user_ids.items():
+                rebuild_rollups(
+                    user_ids=list(user_ids),
+                    start=timezone.localdate(self.first_timestamp),
+                    end=timezone.localdate(self.last_timestamp),
+                    using=alias
+                )
+        
+        imported_user_ids = set().union(*self.imported_user_ids.values())
+        if imported_user_ids:
+            rebuild_entries(user_ids=list(imported_user_ids))
+    
+    def add_error(self, line_number, error):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line_number, 'error': str(error)})
+    
+    def summary(self):
+        elapsed = time.monotonic() - self.started
+        return {
+            'sessions': self.session_count,
+            'messages': self.message_count,
+            'error_count': self.error_count,
+            'errors': self.errors,
+            'elapsed_seconds': round(elapsed, 2),
+            'messages_per_second': round(self.message_count / elapsed) if elapsed else None,
+        }
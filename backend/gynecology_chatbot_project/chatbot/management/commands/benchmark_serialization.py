@@ -0,0 +1,83 @@
+# chatbot/management/commands/benchmark_serialization.py
+
+import gzip
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from gynecology_chatbot_project.middleware import brotli
+from gynecology_chatbot_project.renderers import ORJSONRenderer, orjson
+from chatbot.models import Message
+from chatbot.serializers import MessageSerializer, MessageValuesSerializer
+
+USER_TEXT = "I've had cramping on my lower left side for three days, is that normal?"
+BOT_TEXT = (
+    "Cramping on one side can have several causes, many of them benign, such as "
+    "ovulation pain or digestive discomfort. Keep track of when it happens, how "
+    "strong it is and whether anything makes it better or worse. If the pain is "
+    "severe, comes with fever, unusual bleeding or dizziness, please contact a "
+    "healthcare provider promptly so they can examine you."
+)
+
+
+class Command(BaseCommand):
+    help = "Benchmark serialization time and response size for a large chat session"
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=20)
+    
+    def handle(self, *args, **options):
+        messages = self.build_messages(options['messages'])
+        # What values() returns for the same rows, without touching the database
+        rows = [
+            {field: getattr(message, field) for field in MessageValuesSerializer.fields}
+            for message in messages
+        ]
+        repeat = options['repeat']
+        
+        self.stdout.write(f"{len(messages)} messages, best of {repeat} runs")
+        if orjson is None:
+            self.stdout.write(self.style.WARNING("orjson is not installed; ORJSONRenderer falls back to JSONRenderer"))
+        
+        cases = [
+            ('ModelSerializer + JSONRenderer', lambda: JSONRenderer().render(MessageSerializer(messages, many=True).data)),
+            ('ModelSerializer + ORJSONRenderer', lambda: ORJSONRenderer().render(MessageSerializer(messages, many=True).data)),
+            ('values() rows + JSONRenderer', lambda: JSONRenderer().render(rows)),
+            ('values() rows + ORJSONRenderer', lambda: ORJSONRenderer().render(rows)),
+        ]
+        for name, render in cases:
+            self.stdout.write(f"  {name:<34} {self.best_time(render, repeat) * 1000:8.2f} ms")
+        
+        body = ORJSONRenderer().render(rows)
+        self.stdout.write("Bytes on the wire:")
+        self.stdout.write(f"  {'uncompressed':<34} {len(body):10,d}")
+        self.stdout.write(f"  {'gzip (level 6)':<34} {len(gzip.compress(body, compresslevel=6)):10,d}")
+        if brotli is not None:
+            self.stdout.write(f"  {'brotli (quality 5)':<34} {len(brotli.compress(body, quality=5)):10,d}")
+        else:
+            self.stdout.write(f"  {'brotli':<34} {'not installed':>10}")
+    
+    def build_messages(self, count):
+        """Build unsaved messages resembling a long conversation"""
+        start = timezone.now() - timedelta(days=30)
+        return [
+            Message(
+                id=index + 1,
+                message_type='user' if index % 2 == 0 else 'bot',
+                text=USER_TEXT if index % 2 == 0 else BOT_TEXT,
+                timestamp=start + timedelta(minutes=index),
+                pain_scale=index % 11 if index % 2 == 0 else None,
+                ai_provider='' if index % 2 == 0 else 'chatgpt',
+            )
+            for index in range(count)
+        ]
+    
+    def best_time(self, func, repeat):
+        best = float('inf')
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            best = min(best, time.perf_counter() - started)
+        return best
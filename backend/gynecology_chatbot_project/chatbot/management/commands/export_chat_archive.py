@@ -0,0 +1,41 @@
+# chatbot/management/commands/export_chat_archive.py
+
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from users.models import User
+from chatbot.export import export_records, parse_cursor, stream_ndjson, stream_zip
+
+
+class Command(BaseCommand):
+    help = "Export a user's chat sessions and messages as NDJSON or a zip of per-session files"
+    
+    def add_arguments(self, parser):
+        parser.add_argument('username', help="Username of the patient to export")
+        parser.add_argument('--archive', choices=['ndjson', 'zip'], default='ndjson')
+        parser.add_argument('--output', help="File to write to (defaults to stdout)")
+        parser.add_argument('--cursor', help="Resume after the record with this cursor")
+        parser.add_argument('--chunk-size', type=int, default=1000)
+    
+    def handle(self, *args, **options):
+        user = User.objects.filter(username=options['username']).first()
+        if not user:
+            raise CommandError(f"User '{options['username']}' does not exist")
+        
+        cursor = None
+        if options['cursor']:
+            try:
+                cursor = parse_cursor(options['cursor'])
+            except ValueError:
+                raise CommandError("--cursor must look like '<session id>:<message id>'")
+        
+        records = export_records(user, cursor, chunk_size=options['chunk_size'])
+        stream = stream_zip(records) if options['archive'] == 'zip' else stream_ndjson(records)
+        
+        if options['output']:
+            with open(options['output'], 'wb') as output:
+                for chunk in stream:
+                    output.write(chunk)
+        else:
+            for chunk in stream:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
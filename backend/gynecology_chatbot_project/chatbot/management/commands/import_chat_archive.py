@@ -0,0 +1,50 @@
+# chatbot/management/commands/import_chat_archive.py
+
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from users.models import User
+from chatbot.importer import ChatImporter
+
+
+class Command(BaseCommand):
+    help = "Bulk import chat sessions and messages from an NDJSON file"
+    
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="NDJSON file to import, or - for stdin")
+        parser.add_argument('--user', help="Owner of sessions whose record has no user")
+        parser.add_argument('--chunk-size', type=int, default=5000)
+    
+    def handle(self, *args, **options):
+        default_user = None
+        if options['user']:
+            default_user = User.objects.filter(username=options['user']).first()
+            if not default_user:
+                raise CommandError(f"User '{options['user']}' does not exist")
+        
+        importer = ChatImporter(
+            default_user=default_user,
+            chunk_size=options['chunk_size'],
+            progress=self.report_progress
+        )
+        
+        if options['path'] == '-':
+            summary = importer.run(sys.stdin.buffer)
+        else:
+            with open(options['path'], 'rb') as lines:
+                summary = importer.run(lines)
+        
+        for error in summary['errors']:
+            self.stderr.write(f"Line {error['line']}: {error['error']}")
+        if summary['error_count'] > len(summary['errors']):
+            self.stderr.write(f"... and {summary['error_count'] - len(summary['errors'])} more errors")
+        
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {summary['sessions']} sessions and {summary['messages']} messages "
+            f"in {summary['elapsed_seconds']}s with {summary['error_count']} errors"
+        ))
+    
+    def report_progress(self, summary):
+        self.stdout.write(
+            f"{summary['sessions']} sessions, {summary['messages']} messages, "
+            f"{summary['error_count']} errors ({summary['messages_per_second']} messages/s)"
+        )
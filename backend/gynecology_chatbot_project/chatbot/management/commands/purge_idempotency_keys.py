@@ -0,0 +1,12 @@
+# chatbot/management/commands/purge_idempotency_keys.py
+
+from django.core.management.base import BaseCommand
+from chatbot.idempotency import purge_expired_keys
+
+
+class Command(BaseCommand):
+    help = "Delete send_message idempotency keys older than IDEMPOTENCY_KEY_TTL_HOURS"
+    
+    def handle(self, *args, **options):
+        deleted = purge_expired_keys()
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} expired idempotency keys"))
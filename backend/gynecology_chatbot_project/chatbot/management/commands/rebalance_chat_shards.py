@@ -0,0 +1,61 @@
+# chatbot/management/commands/rebalance_chat_shards.py
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from users.models import User
+from chatbot.sharding import move_user, placement_for
+
+
+class Command(BaseCommand):
+    help = (
+        "Move users' chat data to the shard chosen by the current CHAT_SHARDS "
+        "list, e.g. after adding a shard. Run it while chat traffic is low: "
+        "messages written to a user's data during their move may be lost. "
+        "Sessions and messages keep their ids unless the id is already taken "
+        "on the target shard; renumbered rows break old links and export cursors."
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', dest='usernames',
+                            help="Only move this user (repeatable)")
+        parser.add_argument('--to', dest='target',
+                            help="Move the given users to this shard instead of their computed one")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only report which users would move")
+        parser.add_argument('--chunk-size', type=int, default=1000)
+    
+    def handle(self, *args, **options):
+        target = options['target']
+        if target and not options['usernames']:
+            raise CommandError("--to requires --user")
+        if target and target not in settings.CHAT_SHARDS:
+            raise CommandError(f"'{target}' is not one of CHAT_SHARDS: {', '.join(settings.CHAT_SHARDS)}")
+        
+        users = User.objects.all()
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+        
+        moved = 0
+        renumbered = 0
+        # Users without a shard assignment predate sharding and live on 'default'
+        for user_id, username, current in list(users.values_list('id', 'username', 'chat_shard__alias')):
+            current = current or 'default'
+            destination = target or placement_for(user_id)
+            if current == destination:
+                continue
+            
+            self.stdout.write(f"{username}: {current} -> {destination}")
+            if not options['dry_run']:
+                count = move_user(user_id, current, destination, chunk_size=options['chunk_size'])
+                if count:
+                    self.stdout.write(self.style.WARNING(
+                        f"  {count} sessions/messages got new ids: their ids were taken on {destination}"
+                    ))
+                renumbered += count
+            moved += 1
+        
+        verb = "Would move" if options['dry_run'] else "Moved"
+        summary = f"{verb} {moved} users"
+        if renumbered:
+            summary += f" ({renumbered} sessions/messages renumbered)"
+        self.stdout.write(self.style.SUCCESS(summary))
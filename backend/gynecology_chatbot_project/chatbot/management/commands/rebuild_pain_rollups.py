@@ -0,0 +1,53 @@
+# chatbot/management/commands/rebuild_pain_rollups.py
+
+from collections import defaultdict
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from chatbot.rollups import rebuild_rollups
+from chatbot.sharding import shard_for_user
+
+
+class Command(BaseCommand):
+    help = "Recompute the daily pain scale rollups from the stored chat messages"
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='user_ids',
+                            help="Only rebuild this user's rollups (repeatable)")
+        parser.add_argument('--start', help="First day to rebuild (YYYY-MM-DD)")
+        parser.add_argument('--end', help="Last day to rebuild (YYYY-MM-DD)")
+        parser.add_argument('--batch-size', type=int, default=1000)
+    
+    def handle(self, *args, **options):
+        start = self.parse_day(options['start'], '--start')
+        end = self.parse_day(options['end'], '--end')
+        
+        # Rebuild each shard separately, only touching the shards of the given users
+        if options['user_ids']:
+            users_by_shard = defaultdict(list)
+            for user_id in options['user_ids']:
+                users_by_shard[shard_for_user(user_id, for_write=True)].append(user_id)
+        else:
+            users_by_shard = {alias: None for alias in settings.CHAT_SHARDS}
+        
+        written = 0
+        for alias, user_ids in users_by_shard.items():
+            written += rebuild_rollups(
+                user_ids=user_ids,
+                start=start,
+                end=end,
+                batch_size=options['batch_size'],
+                using=alias
+            )
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} pain rollup rows"))
+    
+    def parse_day(self, value, option):
+        if not value:
+            return None
+        try:
+            day = parse_date(value)
+        except ValueError:
+            day = None
+        if day is None:
+            raise CommandError(f"{option} must be a date in YYYY-MM-DD format")
+        return day
@@ -2,19 +2,23 @@
 
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 
 
 class ChatSession(models.Model):
     """
     Model to store chat sessions between users and the chatbot
     """
+    # No database constraint: chat data may live on a different shard than users
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
-        related_name='chat_sessions'
+        related_name='chat_sessions',
+        db_constraint=False
     )
     title = models.CharField(max_length=255, blank=True)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # A default rather than auto_now_add so imported sessions keep their original time
+    created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
     
     def __str__(self):
@@ -40,10 +44,114 @@ class Message(models.Model):
         choices=MESSAGE_TYPE_CHOICES
     )
     text = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # A default rather than auto_now_add so imported messages keep their original time
+    timestamp = models.DateTimeField(default=timezone.now)
     pain_scale = models.PositiveSmallIntegerField(null=True, blank=True)
     # Store the AI provider that generated this response
     ai_provider = models.CharField(max_length=20, blank=True)
     
     def __str__(self):
-        return f"{self.message_type} message in {self.chat_session}"
\ No newline at end of file
+        return f"{self.message_type} message in {self.chat_session}"
+
+
+class PainScaleRollup(models.Model):
+    """
+    Model to store a daily per-patient summary of the user messages they sent,
+    maintained incrementally as messages arrive (see chatbot/rollups.py)
+    """
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='pain_rollups',
+        db_constraint=False
+    )
+    day = models.DateField()
+    message_count = models.PositiveIntegerField(default=0)
+    session_count = models.PositiveIntegerField(default=0)
+    # Only messages that reported a pain scale are counted here
+    pain_count = models.PositiveIntegerField(default=0)
+    pain_sum = models.PositiveIntegerField(default=0)
+    pain_min = models.PositiveSmallIntegerField(null=True, blank=True)
+    pain_max = models.PositiveSmallIntegerField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['day']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'day'], name='unique_pain_rollup_per_day'),
+        ]
+    
+    @property
+    def pain_avg(self):
+        """Return the average pain scale for the day, or None if none was reported"""
+        if not self.pain_count:
+            return None
+        return round(self.pain_sum / self.pain_count, 2)
+    
+    def __str__(self):
+        return f"Pain rollup {self.day} - {self.user.username}"
+
+
+class IdempotencyKey(models.Model):
+    """
+    Model to store the outcome of a send_message request made with an
+    Idempotency-Key header, so that client retries replay the stored result
+    instead of creating duplicate messages and provider calls
+    """
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='idempotency_keys',
+        db_constraint=False
+    )
+    key = models.CharField(max_length=255)
+    chat_session = models.ForeignKey(
+        ChatSession,
+        on_delete=models.CASCADE,
+        related_name='idempotency_keys'
+    )
+    # Hash of the request payload, to reject a key reused for a different message
+    request_hash = models.CharField(max_length=64)
+    # The user message is set once it is saved, the bot message once the request completes
+    user_message = models.ForeignKey(
+        Message,
+        on_delete=models.CASCADE,
+        null=True,
+        related_name='+'
+    )
+    bot_message = models.ForeignKey(
+        Message,
+        on_delete=models.CASCADE,
+        null=True,
+        related_name='+'
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key_per_user'),
+        ]
+    
+    @property
+    def is_complete(self):
+        return self.bot_message_id is not None
+    
+    def __str__(self):
+        return f"Idempotency key {self.key} - {self.user.username}"
+
+
+class ChatShardAssignment(models.Model):
+    """
+    Model to store which database shard holds a user's chat data. It always
+    lives on the 'default' database (see chatbot/sharding.py)
+    """
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='chat_shard'
+    )
+    alias = models.CharField(max_length=100)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.user.username} on {self.alias}"
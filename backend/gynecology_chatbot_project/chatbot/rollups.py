@@ -0,0 +1,117 @@
+# chatbot/rollups.py
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Min, Sum, Value
+from django.db.models.functions import Coalesce, Greatest, Least, TruncDate
+from django.utils import timezone
+from .models import Message, PainScaleRollup
+
+
+def record_message(message):
+    """Fold a newly created user message into its patient's daily rollup"""
+    if message.message_type != 'user':
+        return
+    
+    # Rollups live on the same shard as the message
+    using = message._state.db
+    day = timezone.localdate(message.timestamp)
+    user_id = message.chat_session.user_id
+    
+    # The session counts once per day, on its first user message of that day
+    first_in_session = not Message.objects.using(using).filter(
+        chat_session_id=message.chat_session_id,
+        message_type='user',
+        timestamp__date=day
+    ).exclude(pk=message.pk).exists()
+    
+    updates = {'message_count': F('message_count') + 1}
+    if first_in_session:
+        updates['session_count'] = F('session_count') + 1
+    
+    if message.pain_scale not in (None, ''):
+        pain = Value(int(message.pain_scale))
+        updates.update({
+            'pain_count': F('pain_count') + 1,
+            'pain_sum': F('pain_sum') + pain,
+            'pain_min': Least(Coalesce('pain_min', pain), pain),
+            'pain_max': Greatest(Coalesce('pain_max', pain), pain),
+        })
+    
+    with transaction.atomic(using=using):
+        rollup, _ = PainScaleRollup.objects.using(using).get_or_create(user_id=user_id, day=day)
+        # Update with F() expressions so concurrent messages don't lose counts
+        PainScaleRollup.objects.using(using).filter(pk=rollup.pk).update(**updates)
+
+
+def rebuild_days(user_id, days, using='default'):
+    """
+    Recount a patient's rollups for some days, after messages on those days
+    were edited or deleted
+    """
+    for day in set(days):
+        rebuild_rollups(user_ids=[user_id], start=day, end=day, using=using)
+
+
+def message_days(chat_session):
+    """Return the days on which a session has user messages"""
+    return set(
+        Message.objects.using(chat_session._state.db)
+        .filter(chat_session=chat_session, message_type='user')
+        .annotate(day=TruncDate('timestamp'))
+        .values_list('day', flat=True)
+        .distinct()
+    )
+
+
+def rebuild_rollups(user_ids=None, start=None, end=None, batch_size=1000, using='default'):
+    """
+    Recompute rollups on one chat shard from the raw messages, optionally
+    limited to some users and an inclusive date range. Returns the number of
+    rollup rows written.
+    """
+    rollups = PainScaleRollup.objects.using(using)
+    messages = Message.objects.using(using).filter(message_type='user')
+    
+    if user_ids is not None:
+        rollups = rollups.filter(user_id__in=user_ids)
+        messages = messages.filter(chat_session__user_id__in=user_ids)
+    if start:
+        rollups = rollups.filter(day__gte=start)
+        messages = messages.filter(timestamp__date__gte=start)
+    if end:
+        rollups = rollups.filter(day__lte=end)
+        messages = messages.filter(timestamp__date__lte=end)
+    
+    rows = (
+        messages
+        .annotate(day=TruncDate('timestamp'))
+        .values('chat_session__user_id', 'day')
+        .annotate(
+            message_count=Count('id'),
+            session_count=Count('chat_session', distinct=True),
+            pain_count=Count('pain_scale'),
+            pain_sum=Coalesce(Sum('pain_scale'), 0),
+            pain_min=Min('pain_scale'),
+            pain_max=Max('pain_scale'),
+        )
+        .order_by()
+    )
+    
+    written = 0
+    with transaction.atomic(using=using):
+        rollups.delete()
+        batch = []
+        for row in rows.iterator(chunk_size=batch_size):
+            batch.append(PainScaleRollup(
+                user_id=row.pop('chat_session__user_id'),
+                **row
+            ))
+            if len(batch) >= batch_size:
+                PainScaleRollup.objects.using(using).bulk_create(batch)
+                written += len(batch)
+                batch = []
+        if batch:
+            PainScaleRollup.objects.using(using).bulk_create(batch)
+            written += len(batch)
+    
+    return written
@@ -1,7 +1,7 @@
 # chatbot/serializers.py
 
 from rest_framework import serializers
-from .models import ChatSession, Message
+from .models import ChatSession, Message, PainScaleRollup
 
 
 class MessageSerializer(serializers.ModelSerializer):
@@ -20,4 +20,64 @@ class ChatSessionSerializer(serializers.ModelSerializer):
     class Meta:
         model = ChatSession
         fields = ['id', 'user', 'title', 'created_at', 'updated_at', 'messages']
-        read_only_fields = ['id', 'created_at', 'updated_at']
\ No newline at end of file
+        read_only_fields = ['id', 'created_at', 'updated_at']
+
+
+class MessageValuesSerializer:
+    """
+    Read-only serializer for hot message list endpoints. It reads plain dicts
+    with values() instead of building model instances and running them through
+    ModelSerializer fields, and renders to the same JSON as MessageSerializer.
+    """
+    fields = MessageSerializer.Meta.fields
+    
+    def __init__(self, queryset):
+        self.queryset = queryset
+    
+    @property
+    def data(self):
+        return list(self.queryset.values(*self.fields))
+
+
+class ChatSessionValuesSerializer:
+    """
+    Read-only, values()-backed equivalent of ChatSessionSerializer for the
+    session list. All nested messages are fetched with a single query.
+    """
+    fields = ['id', 'user', 'title', 'created_at', 'updated_at']
+    
+    def __init__(self, queryset):
+        self.queryset = queryset
+    
+    @property
+    def data(self):
+        # Route once: with several read replicas each routing decision may
+        # pick a different one, and their lag can differ
+        using = self.queryset.db
+        sessions = list(self.queryset.using(using).values(*self.fields))
+        messages_by_session = {}
+        for session in sessions:
+            session['messages'] = messages_by_session[session['id']] = []
+        
+        messages = (
+            Message.objects
+            .using(using)
+            .filter(chat_session_id__in=list(messages_by_session))
+            .order_by('chat_session_id', 'id')
+            .values('chat_session_id', *MessageValuesSerializer.fields)
+        )
+        for message in messages.iterator():
+            messages_by_session[message.pop('chat_session_id')].append(message)
+        
+        return sessions
+
+
+class PainScaleRollupSerializer(serializers.ModelSerializer):
+    """Serializer for one day of a patient's pain scale trend"""
+    pain_avg = serializers.FloatField(read_only=True)
+    
+    class Meta:
+        model = PainScaleRollup
+        fields = ['day', 'message_count', 'session_count', 'pain_count',
+                  'pain_min', 'pain_max', 'pain_avg']
+        read_only_fields = fields
@@ -0,0 +1,210 @@
+# chatbot/sharding.py
+
+import hashlib
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.db.models import Max
+from .models import ChatSession, ChatShardAssignment, IdempotencyKey, Message, PainScaleRollup
+
+CACHE_KEY = 'chat-shard:{}'
+
+
+def sharding_enabled():
+    """Return True if chat data is spread over more than the default database"""
+    return settings.CHAT_SHARDS != ['default']
+
+
+def placement_for(user_id, shards=None):
+    """
+    Pick the shard a user's chat data should live on with rendezvous hashing:
+    when a shard is added only the users that now rank it highest move there.
+    """
+    shards = shards or settings.CHAT_SHARDS
+    return max(
+        shards,
+        key=lambda alias: hashlib.sha1(f'{alias}:{user_id}'.encode()).hexdigest()
+    )
+
+
+def shard_for_user(user, for_write=False):
+    """
+    Return the database alias holding a user's chat data. Users without an
+    assignment predate sharding and keep their data on 'default'.
+    
+    Writes look the assignment up in the directory instead of trusting the
+    cache, so a process that missed a move's cache invalidation can never
+    write new chat data to the shard the user was moved off.
+    """
+    if not sharding_enabled():
+        return 'default'
+    
+    user_id = getattr(user, 'pk', user)
+    cache_key = CACHE_KEY.format(user_id)
+    alias = None if for_write else cache.get(cache_key)
+    if alias is None:
+        alias = ChatShardAssignment.objects.filter(user_id=user_id).values_list(
+            'alias', flat=True
+        ).first() or 'default'
+        cache.set(cache_key, alias, settings.CHAT_SHARD_CACHE_SECONDS)
+    return alias
+
+
+def assign_shard(user):
+    """Place a new user on a shard, keeping any existing assignment"""
+    user_id = getattr(user, 'pk', user)
+    assignment, _ = ChatShardAssignment.objects.get_or_create(
+        user_id=user_id,
+        defaults={'alias': placement_for(user_id)}
+    )
+    cache.delete(CACHE_KEY.format(user_id))
+    return assignment.alias
+
+
+def set_shard(user, alias):
+    """Record that a user's chat data now lives on the given shard"""
+    user_id = getattr(user, 'pk', user)
+    ChatShardAssignment.objects.update_or_create(user_id=user_id, defaults={'alias': alias})
+    cache.delete(CACHE_KEY.format(user_id))
+
+
+def on_user_shard(queryset, user):
+    """
+    Point a chat queryset at the shard holding the user's data. Querysets for
+    the default shard are left to the routers, so reads can still be served
+    by a read replica.
+    """
+    alias = shard_for_user(user)
+    return queryset if alias == 'default' else queryset.using(alias)
+
+
+def move_user(user, source, target, chunk_size=1000):
+    """
+    Move a user's chat data from one shard to another: copy it to the target,
+    point the directory at the target, then delete it from the source.
+    Sessions and messages keep their ids, so URLs and export cursors stay
+    valid, unless the id is already taken on the target; those rows get new
+    ids. Returns the number of sessions and messages that were renumbered.
+    Writes made to the user's chat data while the move is running may be lost.
+    """
+    user_id = getattr(user, 'pk', user)
+    if source == target:
+        return 0
+    
+    keys = list(IdempotencyKey.objects.using(source).filter(user_id=user_id))
+    # Only messages referenced by idempotency keys need their new id remembered
+    referenced = {key.user_message_id for key in keys} | {key.bot_message_id for key in keys}
+    session_ids = {}
+    message_ids = {}
+    renumbered = 0
+    
+    sessions = ChatSession.objects.using(source).filter(user_id=user_id).order_by('id')
+    messages = Message.objects.using(source).filter(chat_session__user_id=user_id).order_by('id')
+    # Move the target's sequences past every id being copied before inserting
+    # anything, so neither renumbered rows nor other users' new chats on the
+    # target can be handed an id that is about to be copied there
+    _advance_sequence(ChatSession, target, sessions.aggregate(Max('id'))['id__max'])
+    _advance_sequence(Message, target, messages.aggregate(Max('id'))['id__max'])
+    
+    with transaction.atomic(using=target):
+        for batch in _batches(sessions.iterator(chunk_size=chunk_size), chunk_size):
+            taken = _taken_ids(ChatSession, target, batch)
+            copies = [
+                ChatSession(
+                    id=None if session.id in taken else session.id,
+                    user_id=user_id,
+                    title=session.title,
+                    created_at=session.created_at
+                )
+                for session in batch
+            ]
+            renumbered += len(taken)
+            ChatSession.objects.using(target).bulk_create(copies)
+            # bulk_create applies auto_now, so restore the original update times
+            for session, copy in zip(batch, copies):
+                session_ids[session.id] = copy.id
+                copy.updated_at = session.updated_at
+            ChatSession.objects.using(target).bulk_update(copies, ['updated_at'])
+        
+        for batch in _batches(messages.iterator(chunk_size=chunk_size), chunk_size):
+            taken = _taken_ids(Message, target, batch)
+            copies = [
+                Message(
+                    id=None if message.id in taken else message.id,
+                    chat_session_id=session_ids[message.chat_session_id],
+                    message_type=message.message_type,
+                    text=message.text,
+                    timestamp=message.timestamp,
+                    pain_scale=message.pain_scale,
+                    ai_provider=message.ai_provider,
+                )
+                for message in batch
+            ]
+            renumbered += len(taken)
+            Message.objects.using(target).bulk_create(copies)
+            for message, copy in zip(batch, copies):
+                if message.id in referenced:
+                    message_ids[message.id] = copy.id
+        
+        rollups = PainScaleRollup.objects.using(source).filter(user_id=user_id)
+        for batch in _batches(rollups.iterator(chunk_size=chunk_size), chunk_size):
+            for rollup in batch:
+                rollup.pk = None
+            PainScaleRollup.objects.using(target).bulk_create(batch)
+        
+        IdempotencyKey.objects.using(target).bulk_create([
+            IdempotencyKey(
+                user_id=user_id,
+                key=key.key,
+                chat_session_id=session_ids[key.chat_session_id],
+                request_hash=key.request_hash,
+                user_message_id=message_ids.get(key.user_message_id),
+                bot_message_id=message_ids.get(key.bot_message_id),
+            )
+            for key in keys
+        ])
+    
+    set_shard(user_id, target)
+    
+    with transaction.atomic(using=source):
+        IdempotencyKey.objects.using(source).filter(user_id=user_id).delete()
+        PainScaleRollup.objects.using(source).filter(user_id=user_id).delete()
+        ChatSession.objects.using(source).filter(user_id=user_id).delete()
+    
+    return renumbered
+
+
+def _advance_sequence(model, using, max_id):
+    """
+    Make sure ids the database hands out for a model are above max_id. Rows
+    inserted with explicit ids don't advance PostgreSQL sequences; the other
+    backends already number new rows past the largest id.
+    """
+    connection = connections[using]
+    if max_id is None or connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        # setval isn't rolled back, so the sequence stays ahead even if the move fails
+        cursor.execute(
+            "SELECT setval(seq, GREATEST(nextval(seq), %s)) "
+            "FROM (SELECT pg_get_serial_sequence(%s, 'id')::regclass AS seq) AS target",
+            [max_id, model._meta.db_table]
+        )
+
+
+def _taken_ids(model, using, batch):
+    """Return the ids of a batch of rows that are already used on another shard"""
+    return set(
+        model.objects.using(using).filter(id__in=[row.id for row in batch]).values_list('id', flat=True)
+    )
+
+
+def _batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
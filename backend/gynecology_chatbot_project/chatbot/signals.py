@@ -0,0 +1,89 @@
+# chatbot/signals.py
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+from .models import ChatSession, IdempotencyKey, Message, PainScaleRollup
+from .rollups import message_days, rebuild_days, record_message
+from .sharding import assign_shard, shard_for_user, sharding_enabled
+
+
+@receiver(pre_save, sender=Message)
+def remember_rollup_day(sender, instance, raw=False, **kwargs):
+    """Remember which day an edited message was counted on, in case its timestamp changes"""
+    if raw or instance._state.adding:
+        return
+    previous = Message.objects.using(instance._state.db).filter(pk=instance.pk).values_list(
+        'timestamp', flat=True
+    ).first()
+    instance._rollup_day = timezone.localdate(previous) if previous else None
+
+
+@receiver(post_save, sender=Message)
+def update_pain_rollup(sender, instance, created, raw=False, **kwargs):
+    """Keep the patient's daily pain rollup current as user messages are saved"""
+    if raw:
+        return
+    if created:
+        record_message(instance)
+    else:
+        # An edit may change the pain scale, type or day, so recount the affected days
+        days = {timezone.localdate(instance.timestamp), getattr(instance, '_rollup_day', None)}
+        rebuild_days(instance.chat_session.user_id, days - {None}, using=instance._state.db)
+
+
+@receiver(post_delete, sender=Message)
+def remove_from_pain_rollup(sender, instance, origin=None, **kwargs):
+    """Recount the day of a deleted user message"""
+    # Messages deleted along with their session are recounted per session below
+    if instance.message_type != 'user' or not deleted_directly(origin, Message):
+        return
+    rebuild_days(
+        instance.chat_session.user_id,
+        [timezone.localdate(instance.timestamp)],
+        using=instance._state.db
+    )
+
+
+@receiver(pre_delete, sender=ChatSession)
+def remember_session_days(sender, instance, origin=None, **kwargs):
+    """Remember the days a session's messages were counted on before they are deleted"""
+    # A deleted user's rollups are deleted with them
+    if not isinstance(origin, get_user_model()):
+        instance._rollup_days = message_days(instance)
+
+
+@receiver(post_delete, sender=ChatSession)
+def remove_session_from_pain_rollup(sender, instance, **kwargs):
+    """Recount the days of a deleted session's messages"""
+    days = getattr(instance, '_rollup_days', None)
+    if days:
+        rebuild_days(instance.user_id, days, using=instance._state.db)
+
+
+def deleted_directly(origin, model):
+    """Return True if a deletion started from model itself rather than cascading from a parent"""
+    return isinstance(origin, model) or getattr(origin, 'model', None) is model
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def place_new_user(sender, instance, created, raw=False, **kwargs):
+    """Assign new users to a chat shard"""
+    if created and not raw and sharding_enabled():
+        assign_shard(instance)
+
+
+@receiver(pre_delete, sender=settings.AUTH_USER_MODEL)
+def delete_sharded_chat_data(sender, instance, **kwargs):
+    """
+    Delete a user's chat data from their shard. Django only cascades within
+    the user's own database, so data on other shards needs to be removed here.
+    """
+    using = shard_for_user(instance, for_write=True)
+    if using == instance._state.db:
+        return
+    
+    for model in (IdempotencyKey, PainScaleRollup, ChatSession):
+        model.objects.using(using).filter(user=instance).delete()
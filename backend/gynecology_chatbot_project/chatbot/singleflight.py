@@ -0,0 +1,52 @@
+# chatbot/singleflight.py
+
+import threading
+
+
+class _Call:
+    """An in-flight call and, once it finishes, its outcome"""
+    
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls that share a key into a single execution.
+    
+    The first caller for a key runs the function; callers arriving while it
+    is still running wait for it and receive the same result (or exception)
+    instead of running the function again.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+    
+    def do(self, key, func):
+        """Run func once per concurrent key; return (result, shared)"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        
+        try:
+            call.result = func()
+        except Exception as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        
+        return call.result, False
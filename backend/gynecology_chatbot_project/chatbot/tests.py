@@ -0,0 +1,522 @@
+# chatbot/tests.py
+
+import functools
+import io
+import json
+import threading
+import zipfile
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock
+from django.conf import settings
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from users.models import User
+from chatbot.importer import ChatImporter
+from chatbot.models import ChatSession, ChatShardAssignment, IdempotencyKey, Message, PainScaleRollup
+from chatbot.rollups import rebuild_rollups
+from chatbot.sharding import move_user, placement_for, set_shard, shard_for_user
+from chatbot.views import MessageViewSet
+
+
+def at(day, hour=12):
+    return datetime(2025, 3, day, hour, tzinfo=dt_timezone.utc)
+
+
+class PainRollupTests(TestCase):
+    """Rollups follow messages as they are created, edited and deleted"""
+    databases = {'default', 'chat_shard_1', 'chat_shard_2'}
+    
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('patient', password='secret')
+        self.shard = shard_for_user(self.user)
+        self.session = ChatSession.objects.using(self.shard).create(user=self.user, title='Cramps')
+    
+    def add_message(self, pain_scale, day=1, message_type='user', session=None):
+        return (session or self.session).messages.create(
+            message_type=message_type,
+            text='It hurts',
+            pain_scale=pain_scale,
+            timestamp=at(day)
+        )
+    
+    def rollups(self):
+        return {
+            rollup.day.day: (rollup.message_count, rollup.session_count, rollup.pain_count,
+                             rollup.pain_sum, rollup.pain_min, rollup.pain_max)
+            for rollup in PainScaleRollup.objects.using(self.shard).filter(user=self.user)
+        }
+    
+    def assertMatchesRebuild(self):
+        """The incrementally maintained rollups equal a full rebuild"""
+        maintained = self.rollups()
+        rebuild_rollups(user_ids=[self.user.id], using=self.shard)
+        self.assertEqual(maintained, self.rollups())
+    
+    def test_new_messages_are_counted(self):
+        self.add_message(4)
+        self.add_message(8)
+        self.add_message(None)
+        self.add_message(None, message_type='bot')
+        self.assertEqual(self.rollups(), {1: (3, 1, 2, 12, 4, 8)})
+        self.assertMatchesRebuild()
+    
+    def test_edited_pain_scale_is_recounted(self):
+        message = self.add_message(4)
+        self.add_message(6)
+        message.pain_scale = 9
+        message.save()
+        self.assertEqual(self.rollups(), {1: (2, 1, 2, 15, 6, 9)})
+    
+    def test_message_moved_to_another_day_is_recounted(self):
+        message = self.add_message(4)
+        message.timestamp = at(2)
+        message.save()
+        self.assertEqual(self.rollups(), {2: (1, 1, 1, 4, 4, 4)})
+    
+    def test_deleted_message_is_removed(self):
+        self.add_message(4)
+        self.add_message(8).delete()
+        self.assertEqual(self.rollups(), {1: (1, 1, 1, 4, 4, 4)})
+    
+    def test_deleted_session_is_removed(self):
+        other = ChatSession.objects.using(self.shard).create(user=self.user, title='Follow-up')
+        self.add_message(4)
+        self.add_message(8, session=other)
+        self.add_message(2, day=2, session=other)
+        other.delete()
+        self.assertEqual(self.rollups(), {1: (1, 1, 1, 4, 4, 4)})
+        self.assertFalse(Message.objects.using(self.shard).filter(pain_scale=8).exists())
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class ChatExportTests(TestCase):
+    """Resumable chat archive exports"""
+    databases = {'default', 'chat_shard_1', 'chat_shard_2'}
+    
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('patient', password='secret')
+        shard = shard_for_user(self.user)
+        self.first = ChatSession.objects.using(shard).create(user=self.user, title='Cramps')
+        self.first.messages.create(message_type='user', text='It hurts', pain_scale=6)
+        self.first.messages.create(message_type='bot', text='Rest')
+        self.second = ChatSession.objects.using(shard).create(user=self.user, title='Cycle')
+        self.second.messages.create(message_type='user', text='Late period')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+    
+    def export(self, **params):
+        return self.client.get('/api/chat-sessions/export/', params)
+    
+    def records(self, response):
+        return [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+    
+    def test_export_lists_sessions_then_their_messages(self):
+        records = self.records(self.export())
+        
+        self.assertEqual(
+            [(record['type'], record.get('title') or record['text']) for record in records],
+            [('session', 'Cramps'), ('message', 'It hurts'), ('message', 'Rest'),
+             ('session', 'Cycle'), ('message', 'Late period')]
+        )
+        self.assertEqual(records[0]['cursor'], f'{self.first.id}:0')
+        self.assertEqual(records[1]['session'], self.first.id)
+        self.assertEqual(records[1]['pain_scale'], 6)
+    
+    def test_resume_mid_session_skips_delivered_records(self):
+        records = self.records(self.export())
+        
+        resumed = self.records(self.export(cursor=records[1]['cursor']))
+        self.assertEqual(resumed, records[2:])
+        # Resuming right after a session header doesn't repeat the header
+        resumed = self.records(self.export(cursor=records[3]['cursor']))
+        self.assertEqual(resumed, records[4:])
+    
+    def test_zip_archive_has_a_file_per_session(self):
+        response = self.export(archive='zip')
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(
+            archive.namelist(), [f'session-{self.first.id}.ndjson', f'session-{self.second.id}.ndjson']
+        )
+        lines = archive.read(f'session-{self.first.id}.ndjson').splitlines()
+        self.assertEqual([json.loads(line)['type'] for line in lines], ['session', 'message', 'message'])
+    
+    def test_invalid_parameters_are_rejected(self):
+        self.assertEqual(self.export(cursor='abc').status_code, 400)
+        self.assertEqual(self.export(cursor='1:x').status_code, 400)
+        self.assertEqual(self.export(archive='tar').status_code, 400)
+    
+    def test_staff_export_of_another_user(self):
+        staff = User.objects.create_user('staff', password='secret', is_staff=True)
+        self.client.force_authenticate(staff)
+        
+        self.assertEqual(len(self.records(self.export(user=self.user.id))), 5)
+        self.assertEqual(self.export(user='abc').status_code, 400)
+        self.assertEqual(self.export(user=self.user.id + 100).status_code, 404)
+
+
+class ChatImporterTests(TestCase):
+    """Bulk imports of chat history"""
+    databases = {'default', 'chat_shard_1', 'chat_shard_2'}
+    
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('p0', password='secret')
+    
+    def test_records_with_invalid_ids_are_reported(self):
+        lines = [
+            '{"type": "session", "id": [1], "user": "p0"}',
+            '{"type": "session", "id": 1, "user": ["p0"]}',
+            '{"type": "session", "id": true, "user": "p0"}',
+            '{"type": "session", "id": 2, "user": "p0", "title": "Imported"}',
+            '{"type": "message", "session": {"a": 1}, "message_type": "user", "text": "x", '
+            '"timestamp": "2025-03-01T12:00:00Z"}',
+            '{"type": "message", "session": 2, "message_type": ["user"], "text": "x", '
+            '"timestamp": "2025-03-01T12:00:00Z"}',
+            '{"type": "message", "session": 2, "message_type": "user", "text": "Cramps", '
+            '"timestamp": "2025-03-01T12:00:00Z", "pain_scale": 6}',
+        ]
+        summary = ChatImporter().run(lines)
+        
+        self.assertEqual(summary['sessions'], 1)
+        self.assertEqual(summary['messages'], 1)
+        self.assertEqual([error['line'] for error in summary['errors']], [1, 2, 3, 5, 6])
+        shard = shard_for_user(self.user)
+        self.assertEqual(
+            list(Message.objects.using(shard).values_list('chat_session__title', 'text', 'pain_scale')),
+            [('Imported', 'Cramps', 6)]
+        )
+
+    
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_endpoint_import_across_chunks(self):
+        other = User.objects.create_user('p1', password='secret')
+        staff = User.objects.create_user('staff', password='secret', is_staff=True)
+        lines = [
+            {'type': 'session', 'id': 'a', 'user': 'p0', 'title': 'Cramps',
+             'created_at': '2025-03-01T09:00:00Z'},
+            {'type': 'session', 'id': 'b', 'title': 'Cycle', 'created_at': '2025-03-01T10:00:00Z'},
+            {'type': 'message', 'session': 'a', 'message_type': 'user', 'text': 'It hurts',
+             'timestamp': '2025-03-01T12:00:00Z', 'pain_scale': 4},
+            {'type': 'message', 'session': 'a', 'message_type': 'user', 'text': 'Worse now',
+             'timestamp': '2025-03-02T12:00:00Z', 'pain_scale': 8},
+            {'type': 'message', 'session': 'b', 'message_type': 'user', 'text': 'Late period',
+             'timestamp': '2025-03-03T12:00:00Z'},
+        ]
+        body = ''.join(json.dumps(line) + '\n' for line in lines)
+        progress = []
+        client = APIClient()
+        client.force_authenticate(staff)
+        
+        # One record per chunk, so every message is written after its session's chunk
+        importer = functools.partial(ChatImporter, chunk_size=1, progress=progress.append)
+        with mock.patch('chatbot.views.ChatImporter', importer):
+            response = client.post(
+                f'/api/chat-sessions/import/?user={other.id}', body, content_type='application/x-ndjson'
+            )
+        
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.json()['sessions'], response.json()['messages']), (2, 3))
+        self.assertEqual(response.json()['error_count'], 0)
+        self.assertEqual(
+            [(update['sessions'], update['messages']) for update in progress],
+            [(1, 0), (2, 0), (2, 1), (2, 2), (2, 3)]
+        )
+        
+        cramps = ChatSession.objects.using(shard_for_user(self.user)).get(user=self.user)
+        self.assertEqual(cramps.title, 'Cramps')
+        self.assertEqual(
+            list(cramps.messages.order_by('id').values_list('text', flat=True)), ['It hurts', 'Worse now']
+        )
+        self.assertEqual(cramps.updated_at, datetime(2025, 3, 2, 12, tzinfo=dt_timezone.utc))
+        cycle = ChatSession.objects.using(shard_for_user(other)).get(user=other)
+        self.assertEqual(cycle.title, 'Cycle')
+        self.assertEqual(cycle.updated_at, datetime(2025, 3, 3, 12, tzinfo=dt_timezone.utc))
+        
+        rollups = PainScaleRollup.objects.using(shard_for_user(self.user)).filter(user=self.user)
+        self.assertEqual(
+            list(rollups.order_by('day').values_list('message_count', 'pain_max')), [(1, 4), (1, 8)]
+        )
+    
+    def test_endpoint_rejects_non_numeric_user(self):
+        staff = User.objects.create_user('staff', password='secret', is_staff=True)
+        client = APIClient()
+        client.force_authenticate(staff)
+        
+        response = client.post('/api/chat-sessions/import/?user=abc', '', content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 400)
+
+
+class SendMessageIdempotencyTests(TransactionTestCase):
+    """send_message with an Idempotency-Key"""
+    databases = {'default', 'chat_shard_1', 'chat_shard_2'}
+    
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('patient', password='secret')
+        self.shard = shard_for_user(self.user)
+        self.session = ChatSession.objects.using(self.shard).create(user=self.user, title='Cramps')
+        self.url = f'/api/chat-sessions/{self.session.id}/send-message/'
+    
+    def send(self, text, key):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        return client.post(self.url, {'text': text}, format='json', HTTP_IDEMPOTENCY_KEY=key)
+    
+    def reply(self, text, provider='chatgpt'):
+        return mock.patch.object(
+            MessageViewSet, 'get_ai_response', return_value={'text': text, 'provider': provider}
+        )
+    
+    def unfinish_key(self):
+        """Make the stored key look like its request died before the reply was saved"""
+        record = IdempotencyKey.objects.using(self.shard).get()
+        IdempotencyKey.objects.using(self.shard).filter(pk=record.pk).update(bot_message=None)
+        Message.objects.using(self.shard).filter(pk=record.bot_message_id).delete()
+        return record
+    
+    def test_retry_replays_stored_reply(self):
+        with self.reply('first'):
+            self.send('Cramps', 'key-1')
+        with self.reply('second') as get_ai_response:
+            response = self.send('Cramps', 'key-1')
+        get_ai_response.assert_not_called()
+        self.assertEqual(response.json()['bot_message']['text'], 'first')
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+    
+    def test_reused_key_with_different_payload_in_flight_is_rejected(self):
+        entered, release = threading.Event(), threading.Event()
+        responses = {}
+        
+        def slow_reply(view, text, chat_session):
+            entered.set()
+            release.wait(5)
+            return {'text': 'first', 'provider': 'chatgpt'}
+        
+        def first_request():
+            responses['first'] = self.send('Cramps', 'key-1')
+        
+        with mock.patch.object(MessageViewSet, 'get_ai_response', slow_reply):
+            leader = threading.Thread(target=first_request)
+            leader.start()
+            self.assertTrue(entered.wait(5))
+            try:
+                response = self.send('DIFFERENT', 'key-1')
+            finally:
+                release.set()
+                leader.join()
+        
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(responses['first'].status_code, 200)
+        self.assertEqual(responses['first'].json()['bot_message']['text'], 'first')
+    
+    def test_fallback_reply_releases_key(self):
+        with self.reply('Please try again later', provider='fallback'):
+            response = self.send('Cramps', 'key-1')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(IdempotencyKey.objects.using(self.shard).exists())
+        self.assertFalse(Message.objects.using(self.shard).exists())
+        
+        with self.reply('answer'):
+            response = self.send('Cramps', 'key-1')
+        self.assertEqual(response.json()['bot_message']['text'], 'answer')
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(
+            list(self.session.messages.order_by('id').values_list('message_type', 'text')),
+            [('user', 'Cramps'), ('bot', 'answer')]
+        )
+    
+    def test_failed_request_releases_key(self):
+        with mock.patch.object(MessageViewSet, 'get_ai_response', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.send('Cramps', 'key-1')
+        self.assertFalse(IdempotencyKey.objects.using(self.shard).exists())
+        self.assertFalse(Message.objects.using(self.shard).exists())
+    
+    def test_abandoned_key_is_taken_over(self):
+        with self.reply('answer'):
+            self.send('Cramps', 'key-1')
+        # A worker killed during the provider call leaves the key unfinished
+        record = self.unfinish_key()
+        IdempotencyKey.objects.using(self.shard).filter(pk=record.pk).update(
+            created_at=timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_WAIT_SECONDS + 1)
+        )
+        
+        with self.reply('retried'):
+            response = self.send('Cramps', 'key-1')
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['user_message']['id'], record.user_message_id)
+        self.assertEqual(
+            list(self.session.messages.order_by('id').values_list('message_type', 'text')),
+            [('user', 'Cramps'), ('bot', 'retried')]
+        )
+        self.assertTrue(IdempotencyKey.objects.using(self.shard).get().is_complete)
+    
+    def test_unfinished_key_within_wait_is_not_taken_over(self):
+        with self.reply('answer'):
+            self.send('Cramps', 'key-1')
+        self.unfinish_key()
+        
+        # The retry gave up waiting, but the key is too recent to take over
+        with mock.patch('chatbot.views.wait_for_result', return_value=None):
+            with self.reply('retried') as get_ai_response:
+                response = self.send('Cramps', 'key-1')
+        
+        self.assertEqual(response.status_code, 409)
+        get_ai_response.assert_not_called()
+    
+    def test_overlong_key_is_rejected(self):
+        with self.reply('answer'):
+            response = self.send('Cramps', 'k' * 256)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Message.objects.using(self.shard).exists())
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class ShardingTests(TestCase):
+    """Chat data lives on its user's shard"""
+    databases = {'default', 'chat_shard_1', 'chat_shard_2'}
+    
+    def setUp(self):
+        cache.clear()
+    
+    def user_on(self, alias, username='patient'):
+        user = User.objects.create_user(username, password='secret')
+        set_shard(user, alias)
+        return user
+    
+    def chat_rows(self, alias, user_id):
+        return (
+            ChatSession.objects.using(alias).filter(user_id=user_id).count(),
+            Message.objects.using(alias).filter(chat_session__user_id=user_id).count(),
+            PainScaleRollup.objects.using(alias).filter(user_id=user_id).count(),
+            IdempotencyKey.objects.using(alias).filter(user_id=user_id).count(),
+        )
+    
+    def test_new_users_are_placed_by_rendezvous_hash(self):
+        users = [User.objects.create_user(f'user{i}', password='secret') for i in range(30)]
+        
+        placed = dict(ChatShardAssignment.objects.values_list('user_id', 'alias'))
+        self.assertEqual(placed, {user.id: placement_for(user.id) for user in users})
+        self.assertEqual(set(placed.values()), {'default', 'chat_shard_1', 'chat_shard_2'})
+        self.assertEqual(shard_for_user(users[0]), placed[users[0].id])
+    
+    def test_api_flows_on_non_default_shard(self):
+        user = self.user_on('chat_shard_2')
+        client = APIClient()
+        client.force_authenticate(user)
+        
+        session_id = client.post('/api/chat-sessions/', {'title': 'Cramps', 'user': user.id}, format='json').json()['id']
+        with mock.patch.object(
+            MessageViewSet, 'get_ai_response', return_value={'text': 'Rest', 'provider': 'chatgpt'}
+        ):
+            response = client.post(
+                f'/api/chat-sessions/{session_id}/send-message/',
+                {'text': 'It hurts', 'pain_scale': 7},
+                format='json',
+                HTTP_IDEMPOTENCY_KEY='key-1'
+            )
+        self.assertEqual(response.status_code, 200)
+        
+        self.assertEqual(self.chat_rows('chat_shard_2', user.id), (1, 2, 1, 1))
+        self.assertEqual(self.chat_rows('default', user.id), (0, 0, 0, 0))
+        self.assertEqual(len(client.get('/api/chat-sessions/').json()[0]['messages']), 2)
+        self.assertEqual(len(client.get(f'/api/chat-sessions/{session_id}/messages/').json()), 2)
+        self.assertEqual(client.get(f'/api/patients/{user.id}/pain-trend/').json()['summary']['pain_max'], 7)
+        export = b''.join(client.get('/api/chat-sessions/export/').streaming_content)
+        self.assertEqual(len(export.splitlines()), 3)
+    
+    def test_move_user_keeps_ids(self):
+        user = self.user_on('chat_shard_1')
+        session = ChatSession.objects.using('chat_shard_1').create(user=user, title='Cramps')
+        message = session.messages.create(message_type='user', text='It hurts', pain_scale=5)
+        bot_message = session.messages.create(message_type='bot', text='Rest')
+        IdempotencyKey.objects.using('chat_shard_1').create(
+            user=user, key='key-1', chat_session=session, request_hash='hash',
+            user_message=message, bot_message=bot_message
+        )
+        
+        self.assertEqual(move_user(user, 'chat_shard_1', 'chat_shard_2'), 0)
+        
+        self.assertEqual(shard_for_user(user), 'chat_shard_2')
+        self.assertEqual(self.chat_rows('chat_shard_1', user.id), (0, 0, 0, 0))
+        self.assertEqual(self.chat_rows('chat_shard_2', user.id), (1, 2, 1, 1))
+        moved = ChatSession.objects.using('chat_shard_2').get(user=user)
+        self.assertEqual(moved.id, session.id)
+        self.assertEqual(moved.updated_at, session.updated_at)
+        self.assertEqual(
+            sorted(moved.messages.values_list('id', flat=True)), [message.id, bot_message.id]
+        )
+        key = IdempotencyKey.objects.using('chat_shard_2').get(user=user)
+        self.assertEqual((key.user_message_id, key.bot_message_id), (message.id, bot_message.id))
+    
+    def test_move_user_renumbers_ids_taken_on_target(self):
+        user = self.user_on('chat_shard_1')
+        other = self.user_on('chat_shard_2', 'other')
+        session = ChatSession.objects.using('chat_shard_1').create(user=user, title='Cramps')
+        message = session.messages.create(message_type='user', text='It hurts')
+        taken = ChatSession.objects.using('chat_shard_2').create(id=session.id, user=other)
+        
+        self.assertEqual(move_user(user, 'chat_shard_1', 'chat_shard_2'), 1)
+        
+        moved = ChatSession.objects.using('chat_shard_2').get(user=user)
+        self.assertNotEqual(moved.id, taken.id)
+        self.assertEqual(list(moved.messages.values_list('id', flat=True)), [message.id])
+        # New rows continue after the copied ids
+        self.assertGreater(
+            ChatSession.objects.using('chat_shard_2').create(user=other).id, moved.id
+        )
+    
+    def test_move_user_advances_target_sequences_before_copying(self):
+        user = self.user_on('chat_shard_1')
+        session = ChatSession.objects.using('chat_shard_1').create(user=user, title='Cramps')
+        first = session.messages.create(message_type='user', text='It hurts')
+        last = session.messages.create(message_type='bot', text='Rest')
+        
+        calls = []
+        def advance(model, using, max_id):
+            calls.append((model, using, max_id, model.objects.using(using).count()))
+        
+        with mock.patch('chatbot.sharding._advance_sequence', side_effect=advance):
+            move_user(user, 'chat_shard_1', 'chat_shard_2')
+        
+        # Sequences move past the largest incoming ids while the target is still empty
+        self.assertEqual(calls, [
+            (ChatSession, 'chat_shard_2', session.id, 0),
+            (Message, 'chat_shard_2', max(first.id, last.id), 0),
+        ])
+    
+    def test_writes_ignore_stale_cached_shard(self):
+        user = self.user_on('chat_shard_1')
+        self.assertEqual(shard_for_user(user), 'chat_shard_1')
+        # Another process moved the user; this process never saw the cache invalidation
+        ChatShardAssignment.objects.filter(user=user).update(alias='chat_shard_2')
+        
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.post('/api/chat-sessions/', {'title': 'New', 'user': user.id}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(ChatSession.objects.using('chat_shard_2').filter(user=user).exists())
+        self.assertFalse(ChatSession.objects.using('chat_shard_1').filter(user=user).exists())
+    
+    def test_deleting_user_removes_data_on_other_shard(self):
+        user = self.user_on('chat_shard_1')
+        session = ChatSession.objects.using('chat_shard_1').create(user=user, title='Cramps')
+        session.messages.create(message_type='user', text='It hurts', pain_scale=5)
+        IdempotencyKey.objects.using('chat_shard_1').create(
+            user=user, key='key-1', chat_session=session, request_hash='hash'
+        )
+        
+        user_id = user.id
+        self.assertEqual(self.chat_rows('chat_shard_1', user_id), (1, 1, 1, 1))
+        
+        user.delete()
+        
+        self.assertEqual(self.chat_rows('chat_shard_1', user_id), (0, 0, 0, 0))
+        self.assertFalse(User.objects.filter(username='patient').exists())
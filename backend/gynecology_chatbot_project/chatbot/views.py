@@ -3,50 +3,259 @@
 import os
 import json
 import requests
+from datetime import timedelta
 from django.conf import settings
+from django.db.models import Max, Min, Sum
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
-from .models import ChatSession, Message
-from .serializers import ChatSessionSerializer, MessageSerializer
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from doctors.models import Appointment
+from gynecology_chatbot_project.db_routers import ReplicaReadsMixin
+from gynecology_chatbot_project.renderers import NDJSONParser
+from users.models import User
+from .export import export_records, parse_cursor, stream_ndjson, stream_zip
+from .idempotency import (
+    KEY_MAX_LENGTH, IdempotencyConflict, claim_key, request_hash, send_message_flights,
+    wait_for_result,
+)
+from .importer import ChatImporter
+from .models import ChatSession, Message, PainScaleRollup
+from .serializers import (
+    ChatSessionSerializer, ChatSessionValuesSerializer, MessageSerializer,
+    MessageValuesSerializer, PainScaleRollupSerializer,
+)
+from .sharding import on_user_shard, shard_for_user
 
 
-class ChatSessionViewSet(viewsets.ModelViewSet):
+class ChatSessionViewSet(ReplicaReadsMixin, viewsets.ModelViewSet):
     """Manage chat sessions in the database"""
     serializer_class = ChatSessionSerializer
     permission_classes = [IsAuthenticated]
     
     def get_queryset(self):
         """Return objects for the current authenticated user only"""
-        return ChatSession.objects.filter(user=self.request.user).order_by('-updated_at')
+        return on_user_shard(ChatSession.objects, self.request.user).filter(
+            user=self.request.user
+        ).order_by('-updated_at')
+    
+    def list(self, request, *args, **kwargs):
+        """List sessions through the lightweight values()-backed serializer"""
+        queryset = self.filter_queryset(self.get_queryset())
+        return Response(ChatSessionValuesSerializer(queryset).data)
     
     def perform_create(self, serializer):
-        """Create a new chat session"""
-        serializer.save(user=self.request.user)
+        """Create a new chat session on the user's shard"""
+        serializer.instance = ChatSession.objects.using(shard_for_user(self.request.user, for_write=True)).create(
+            **{**serializer.validated_data, 'user': self.request.user}
+        )
+    
+    @action(detail=False, methods=['GET'])
+    def export(self, request):
+        """
+        Stream the user's full chat archive as NDJSON (default) or as a zip of
+        per-session NDJSON files (?archive=zip). Pass the cursor of the last
+        record received as ?cursor= to resume an interrupted export.
+        Staff may export another user's archive with ?user=<id>.
+        """
+        user = request.user
+        user_id = request.query_params.get('user')
+        if user_id and request.user.is_staff:
+            try:
+                user = User.objects.filter(id=int(user_id)).first()
+            except ValueError:
+                return Response(
+                    {'error': 'user must be a user id'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            if not user:
+                return Response(
+                    {'error': 'User not found'},
+                    status=status.HTTP_404_NOT_FOUND
+                )
+        
+        cursor = request.query_params.get('cursor')
+        if cursor:
+            try:
+                cursor = parse_cursor(cursor)
+            except ValueError:
+                return Response(
+                    {'error': 'Invalid cursor'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        
+        archive = request.query_params.get('archive', 'ndjson')
+        if archive not in ('ndjson', 'zip'):
+            return Response(
+                {'error': 'archive must be ndjson or zip'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        records = export_records(user, cursor)
+        if archive == 'zip':
+            response = StreamingHttpResponse(stream_zip(records), content_type='application/zip')
+        else:
+            response = StreamingHttpResponse(stream_ndjson(records), content_type='application/x-ndjson')
+        response['Content-Disposition'] = f'attachment; filename="chat-archive-{user.id}.{archive}"'
+        return response
+    
+    @action(detail=False, methods=['POST'], url_path='import',
+            permission_classes=[IsAdminUser], parser_classes=[NDJSONParser])
+    def import_archive(self, request):
+        """
+        Bulk import sessions and messages from an application/x-ndjson request
+        body (the format produced by the export). Sessions without a user are assigned
+        to ?user=<id>. Returns the import summary.
+        """
+        default_user = None
+        user_id = request.query_params.get('user')
+        if user_id:
+            try:
+                default_user = User.objects.filter(id=int(user_id)).first()
+            except ValueError:
+                return Response(
+                    {'error': 'user must be a user id'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            if not default_user:
+                return Response(
+                    {'error': 'User not found'},
+                    status=status.HTTP_404_NOT_FOUND
+                )
+        
+        # NDJSONParser hands over the body line by line instead of loading it at once
+        summary = ChatImporter(default_user=default_user).run(request.data)
+        return Response(summary, status=status.HTTP_201_CREATED)
+
+
+class PainTrendViewSet(ReplicaReadsMixin, viewsets.ReadOnlyModelViewSet):
+    """View a patient's daily pain scale trend (read-only)"""
+    serializer_class = PainScaleRollupSerializer
+    permission_classes = [IsAuthenticated]
+    
+    # Range returned when the request does not specify one
+    DEFAULT_RANGE_DAYS = 30
+    
+    def get_queryset(self):
+        """Return the rollups of the requested patient"""
+        patient_id = self.kwargs.get('patient_id')
+        return on_user_shard(PainScaleRollup.objects, patient_id).filter(user_id=patient_id)
+    
+    def can_view_patient(self, patient_id):
+        """Patients may see their own trend, doctors the trend of their patients"""
+        user = self.request.user
+        
+        if user.is_staff or user.id == patient_id:
+            return True
+        if user.user_type == 'doctor':
+            return Appointment.objects.filter(
+                doctor__user=user,
+                patient_id=patient_id
+            ).exists()
+        return False
+    
+    def list(self, request, patient_id=None):
+        """Return per-day rollups and a summary for a date range"""
+        if not self.can_view_patient(patient_id):
+            return Response(
+                {'error': 'Patient not found or not under your care'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        
+        try:
+            end = self.parse_day('end') or timezone.localdate()
+            start = self.parse_day('start') or end - timedelta(days=self.DEFAULT_RANGE_DAYS - 1)
+        except ValueError:
+            return Response(
+                {'error': 'start and end must be dates in YYYY-MM-DD format'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if start > end:
+            return Response(
+                {'error': 'start must not be after end'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        queryset = self.get_queryset().filter(day__range=(start, end))
+        totals = queryset.aggregate(
+            message_count=Sum('message_count'),
+            session_count=Sum('session_count'),
+            pain_count=Sum('pain_count'),
+            pain_sum=Sum('pain_sum'),
+            pain_min=Min('pain_min'),
+            pain_max=Max('pain_max'),
+        )
+        pain_count = totals['pain_count'] or 0
+        
+        return Response({
+            'patient': patient_id,
+            'start': start,
+            'end': end,
+            'summary': {
+                'message_count': totals['message_count'] or 0,
+                'session_count': totals['session_count'] or 0,
+                'pain_count': pain_count,
+                'pain_min': totals['pain_min'],
+                'pain_max': totals['pain_max'],
+                'pain_avg': round(totals['pain_sum'] / pain_count, 2) if pain_count else None,
+            },
+            'days': self.get_serializer(queryset, many=True).data
+        })
+    
+    def parse_day(self, param):
+        """Parse a YYYY-MM-DD query parameter, raising ValueError if malformed"""
+        value = self.request.query_params.get(param)
+        if not value:
+            return None
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"Invalid date: {value}")
+        return day
 
 
-class MessageViewSet(viewsets.ModelViewSet):
+class MessageViewSet(ReplicaReadsMixin, viewsets.ModelViewSet):
     """Manage messages in the database"""
     serializer_class = MessageSerializer
     permission_classes = [IsAuthenticated]
     
+    def get_chat_session(self):
+        """Return the requested chat session if it belongs to the current user"""
+        chat_session_id = self.kwargs.get('chat_session_id')
+        if not chat_session_id:
+            return None
+        
+        return on_user_shard(ChatSession.objects, self.request.user).filter(
+            id=chat_session_id,
+            user=self.request.user
+        ).first()
+    
     def get_queryset(self):
         """Return messages for a specific chat session"""
-        chat_session_id = self.kwargs.get('chat_session_id')
+        chat_session = self.get_chat_session()
         
-        if chat_session_id:
-            # Ensure the chat session belongs to the current user
-            chat_session = ChatSession.objects.filter(
-                id=chat_session_id,
-                user=self.request.user
-            ).first()
-            
-            if chat_session:
-                return Message.objects.filter(chat_session=chat_session).order_by('timestamp')
+        if chat_session:
+            # The related manager keeps the query on the session's shard
+            return chat_session.messages.order_by('timestamp')
         
         return Message.objects.none()
     
+    def perform_create(self, serializer):
+        """Add a message to the chat session, on the session's shard"""
+        chat_session = self.get_chat_session()
+        if not chat_session:
+            raise NotFound('Chat session not found or not owned by user')
+        serializer.instance = chat_session.messages.create(**serializer.validated_data)
+    
+    def list(self, request, *args, **kwargs):
+        """List messages through the lightweight values()-backed serializer"""
+        queryset = self.filter_queryset(self.get_queryset())
+        return Response(MessageValuesSerializer(queryset).data)
+    
     @action(detail=False, methods=['POST'])
     def send_message(self, request, chat_session_id=None):
         """Send a message and get a response from the chatbot"""
@@ -57,10 +266,7 @@ class MessageViewSet(viewsets.ModelViewSet):
             )
         
         # Validate chat session ownership
-        chat_session = ChatSession.objects.filter(
-            id=chat_session_id,
-            user=self.request.user
-        ).first()
+        chat_session = self.get_chat_session()
         
         if not chat_session:
             return Response(
@@ -78,38 +284,121 @@ class MessageViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Save user message
-        user_message = Message.objects.create(
-            chat_session=chat_session,
-            message_type='user',
-            text=text,
-            pain_scale=pain_scale
-        )
-        
-        # Get chatbot response
-        ai_response = self.get_ai_response(text, chat_session)
+        # Retries with the same Idempotency-Key replay the stored result, and
+        # identical requests already in flight in this process share one call
+        key = request.headers.get('Idempotency-Key')
+        if key and len(key) > KEY_MAX_LENGTH:
+            return Response(
+                {'error': f'Idempotency-Key must be at most {KEY_MAX_LENGTH} characters'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        # Save bot response
-        bot_message = Message.objects.create(
-            chat_session=chat_session,
-            message_type='bot',
-            text=ai_response['text'],
-            ai_provider=ai_response['provider']
-        )
+        payload_hash = request_hash(chat_session, text, pain_scale)
+        if key:
+            # A reused key with a different payload must not join the flight,
+            # so claim_key can reject it
+            flight_key = (request.user.id, key, payload_hash)
+        else:
+            flight_key = (request.user.id, chat_session.id, payload_hash)
+        
+        try:
+            (data, replayed), shared = send_message_flights.do(
+                flight_key,
+                lambda: self.exchange_messages(chat_session, text, pain_scale, key, payload_hash)
+            )
+        except IdempotencyConflict as exc:
+            return Response({'error': str(exc)}, status=exc.status_code)
         
-        # Update chat session timestamp
-        chat_session.save()  # This will update the updated_at field
+        response = Response(data)
+        if replayed or shared:
+            response['Idempotent-Replayed'] = 'true'
+        return response
+    
+    def exchange_messages(self, chat_session, text, pain_scale, key=None, payload_hash=None):
+        """
+        Save the user message, get and save the chatbot reply, and return
+        (response data, replayed). With an idempotency key, a request that
+        was already answered returns the stored messages instead.
+        """
+        record = None
+        if key:
+            record, created = claim_key(self.request.user, key, chat_session, payload_hash)
+            if not created:
+                record = wait_for_result(record)
+                if record is None:
+                    # The holder failed or never finished; claiming again takes
+                    # the key over once it has been held longer than the wait
+                    record, created = claim_key(self.request.user, key, chat_session, payload_hash)
+            if not created:
+                if not record.is_complete:
+                    raise IdempotencyConflict(
+                        'A request with this Idempotency-Key is still being processed',
+                        status.HTTP_409_CONFLICT
+                    )
+                return {
+                    'user_message': MessageSerializer(record.user_message).data,
+                    'bot_message': MessageSerializer(record.bot_message).data
+                }, True
+        
+        user_message = None
+        try:
+            if record and record.user_message_id:
+                # Taken over from a request that saved the user message and died
+                user_message = record.user_message
+            else:
+                # Save user message
+                user_message = chat_session.messages.create(
+                    message_type='user',
+                    text=text,
+                    pain_scale=pain_scale
+                )
+                if record:
+                    # Remember it straight away, so a retry that takes the key
+                    # over doesn't save the message a second time
+                    record.user_message = user_message
+                    record.save(update_fields=['user_message'])
+            
+            # Get chatbot response
+            ai_response = self.get_ai_response(text, chat_session)
+            
+            # Save bot response
+            bot_message = chat_session.messages.create(
+                message_type='bot',
+                text=ai_response['text'],
+                ai_provider=ai_response['provider']
+            )
+            
+            # Update chat session timestamp
+            chat_session.save()  # This will update the updated_at field
+            
+            if record and ai_response['provider'] == 'fallback':
+                # No provider answered; remove the exchange and release the key
+                # so a retry asks the providers again without repeating the message
+                bot_message.delete()
+                user_message.delete()
+            elif record:
+                record.bot_message = bot_message
+                record.save(update_fields=['bot_message'])
+        except Exception:
+            # Release the key and drop the half-finished exchange so the client can retry
+            if record:
+                if user_message:
+                    # Deleting the message deletes the key with it
+                    user_message.delete()
+                else:
+                    record.delete()
+            raise
         
         # Return both messages
-        return Response({
+        return {
             'user_message': MessageSerializer(user_message).data,
             'bot_message': MessageSerializer(bot_message).data
-        })
+        }, False
     
     def get_ai_response(self, user_text, chat_session):
         """Get a response from one of the AI providers"""
         # Get chat history for context (last 10 messages)
-        history = Message.objects.filter(chat_session=chat_session).order_by('-timestamp')[:10]
+        history = chat_session.messages.order_by('-timestamp')[:10]
         history_formatted = []
         
         for msg in reversed(list(history)):
@@ -179,7 +468,7 @@ class MessageViewSet(viewsets.ModelViewSet):
             "temperature": 0.7
         }
         
-        response = requests.post(url, headers=headers, json=data)
+        response = requests.post(url, headers=headers, json=data, timeout=settings.AI_PROVIDER_TIMEOUT_SECONDS)
         response.raise_for_status()
         
         return response.json()["choices"][0]["message"]["content"]
@@ -228,7 +517,7 @@ class MessageViewSet(viewsets.ModelViewSet):
             }
         }
         
-        response = requests.post(url, json=data)
+        response = requests.post(url, json=data, timeout=settings.AI_PROVIDER_TIMEOUT_SECONDS)
         response.raise_for_status()
         
         return response.json()["candidates"][0]["content"]["parts"][0]["text"]
@@ -264,7 +553,7 @@ class MessageViewSet(viewsets.ModelViewSet):
             "temperature": 0.7
         }
         
-        response = requests.post(url, headers=headers, json=data)
+        response = requests.post(url, headers=headers, json=data, timeout=settings.AI_PROVIDER_TIMEOUT_SECONDS)
         response.raise_for_status()
         
         # Note: The response parsing may need to be adjusted based on Grok's actual API format
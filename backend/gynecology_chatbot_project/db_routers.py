@@ -0,0 +1,190 @@
+# gynecology_chatbot_project/db_routers.py
+
+import random
+from asgiref.local import Local
+from django.conf import settings
+from django.core.cache import cache
+
+# Per-request routing state, safe for both threaded and async workers
+_state = Local()
+
+PIN_CACHE_KEY = 'db-pin:{}'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def use_replicas(enabled=True):
+    """Allow (or stop allowing) reads in the current context to go to a replica"""
+    _state.use_replicas = enabled
+
+
+def pin_to_primary():
+    """Send every query in the current context to the primary database"""
+    _state.use_replicas = False
+    _state.wrote = True
+
+
+def reset_routing():
+    """Clear routing state at the end of a request"""
+    _state.use_replicas = False
+    _state.wrote = False
+
+
+def has_written():
+    """Return True if the current context has written to the primary"""
+    return getattr(_state, 'wrote', False)
+
+
+def pin_user(user_id):
+    """Send a user's reads to the primary for DATABASE_REPLICA_PIN_SECONDS"""
+    cache.set(PIN_CACHE_KEY.format(user_id), True, settings.DATABASE_REPLICA_PIN_SECONDS)
+
+
+def is_pinned(user_id):
+    """Return True if the user wrote recently and must read from the primary"""
+    return cache.get(PIN_CACHE_KEY.format(user_id)) is not None
+
+
+class ChatShardRouter:
+    """
+    Route the chatbot app's per-user data to the user's chat shard.
+    
+    Chat querysets are pointed at a shard explicitly (see
+    chatbot.sharding.on_user_shard); this router covers the implicit cases,
+    i.e. saving or following relations from an instance, and keeps the shard
+    directory on 'default'. Everything else falls through to the next router.
+    """
+    
+    def shard_for_instance(self, instance, for_write=False):
+        from chatbot.models import ChatSession, Message
+        from chatbot.sharding import shard_for_user
+        
+        # Hints can also be the related object, e.g. the user a session belongs to
+        if instance._meta.app_label != 'chatbot':
+            return None
+        if instance._state.db in settings.CHAT_SHARDS:
+            return instance._state.db
+        if isinstance(instance, ChatSession):
+            return shard_for_user(instance.user_id, for_write=for_write)
+        if isinstance(instance, Message) and Message.chat_session.is_cached(instance):
+            return self.shard_for_instance(instance.chat_session, for_write)
+        return None
+    
+    def route(self, model, hints, for_write):
+        if model._meta.app_label != 'chatbot':
+            return None
+        if model._meta.model_name == 'chatshardassignment':
+            return 'default'
+        
+        instance = hints.get('instance')
+        if instance is None:
+            return None
+        
+        alias = self.shard_for_instance(instance, for_write)
+        # Reads from the default shard may still be served by a replica
+        if alias == 'default' and not for_write:
+            return None
+        return alias
+    
+    def db_for_read(self, model, **hints):
+        return self.route(model, hints, for_write=False)
+    
+    def db_for_write(self, model, **hints):
+        alias = self.route(model, hints, for_write=True)
+        if alias:
+            pin_to_primary()
+        return alias
+    
+    def allow_relation(self, obj1, obj2, **hints):
+        # Chat rows reference users on 'default' without database constraints
+        return True
+    
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if model_name == 'chatshardassignment':
+            return db == 'default'
+        if db != 'default' and db in settings.CHAT_SHARDS:
+            return app_label == 'chatbot'
+        return None
+
+
+class PrimaryReplicaRouter:
+    """
+    Route writes to the primary ('default') and safe reads to a read replica.
+
+    Reads only go to a replica when the current request has opted in (see
+    ReplicaReadsMixin) and has not written anything yet, so management
+    commands, admin actions and write requests always read from the primary.
+    Only apps listed in DATABASE_REPLICA_APPS are replicated reads; sessions,
+    auth and OAuth tokens are always read from the primary so a freshly
+    issued login works immediately.
+    """
+
+    def db_for_read(self, model, **hints):
+        replicas = getattr(settings, 'DATABASE_REPLICAS', [])
+        if (
+            replicas
+            and getattr(_state, 'use_replicas', False)
+            and model._meta.app_label in settings.DATABASE_REPLICA_APPS
+        ):
+            return random.choice(replicas)
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        # Anything read after a write in this request must see that write
+        pin_to_primary()
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas mirror the primary, so any two objects can be related
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas receive schema changes through replication
+        return db not in getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+class ReplicaPinningMiddleware:
+    """
+    Reset routing state for each request and give read-your-writes stickiness.
+    
+    After a request that wrote anything, the authenticated user is pinned to
+    the primary for DATABASE_REPLICA_PIN_SECONDS; while pinned none of their
+    reads go to a replica, which hides replication lag right after e.g.
+    sending a message or booking. The pin is kept in the cache, keyed by user,
+    so it works for bearer-token clients that don't keep cookies.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        reset_routing()
+        try:
+            response = self.get_response(request)
+            # DRF sets request.user once it has authenticated the bearer token
+            user = getattr(request, 'user', None)
+            if (
+                (has_written() or request.method not in SAFE_METHODS)
+                and user is not None
+                and user.is_authenticated
+            ):
+                pin_user(user.pk)
+            return response
+        finally:
+            reset_routing()
+
+
+class ReplicaReadsMixin:
+    """
+    Viewset mixin that lets safe requests read from a replica.
+    
+    Runs after DRF has authenticated the request, so users authenticated by a
+    bearer token are recognised and kept on the primary while pinned.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        use_replicas(
+            request.method in SAFE_METHODS
+            and not has_written()
+            and not (request.user.is_authenticated and is_pinned(request.user.pk))
+        )
@@ -1,6 +1,6 @@
 # doctors/admin.py
 from django.contrib import admin
-from .models import DoctorProfile, Appointment
+from .models import DoctorProfile, Appointment, TriageEntry
 
 class DoctorProfileAdmin(admin.ModelAdmin):
     """Admin View for DoctorProfile"""
@@ -27,5 +27,15 @@ class AppointmentAdmin(admin.ModelAdmin):
         return f"Dr. {obj.doctor.user.get_full_name()}"
     get_doctor_name.short_description = 'Doctor Name'
 
+class TriageEntryAdmin(admin.ModelAdmin):
+    """Admin View for TriageEntry"""
+    list_display = ('patient', 'latest_pain_scale', 'pain_reported_at', 'last_activity_at',
+                    'has_pending_appointment', 'priority')
+    list_filter = ('has_pending_appointment', 'latest_pain_scale')
+    search_fields = ('patient__username', 'patient__email')
+    readonly_fields = ('patient', 'latest_pain_scale', 'pain_reported_at', 'last_activity_at',
+                       'has_pending_appointment', 'priority', 'updated_at')
+
 admin.site.register(DoctorProfile, DoctorProfileAdmin)
-admin.site.register(Appointment, AppointmentAdmin)
\ No newline at end of file
+admin.site.register(Appointment, AppointmentAdmin)
+admin.site.register(TriageEntry, TriageEntryAdmin)
\ No newline at end of file
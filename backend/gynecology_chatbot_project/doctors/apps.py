@@ -0,0 +1,12 @@
+# doctors/apps.py
+
+from django.apps import AppConfig
+
+
+class DoctorsConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'doctors'
+    
+    def ready(self):
+        # Register signal handlers
+        from . import signals  # noqa: F401
@@ -0,0 +1,17 @@
+# doctors/management/commands/rebuild_triage_queue.py
+
+from django.core.management.base import BaseCommand
+from doctors.triage import rebuild_entries
+
+
+class Command(BaseCommand):
+    help = "Recompute the doctors' triage queue from chat messages and appointments"
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='user_ids',
+                            help="Only rebuild this patient's entry (repeatable)")
+        parser.add_argument('--batch-size', type=int, default=1000)
+    
+    def handle(self, *args, **options):
+        written = rebuild_entries(user_ids=options['user_ids'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} triage entries"))
@@ -57,4 +57,34 @@ class Appointment(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     
     def __str__(self):
-        return f"Appointment: {self.patient.username} with Dr. {self.doctor.user.last_name}"
\ No newline at end of file
+        return f"Appointment: {self.patient.username} with Dr. {self.doctor.user.last_name}"
+
+
+class TriageEntry(models.Model):
+    """
+    Model to store each patient's place in the doctors' triage queue,
+    updated as patients send messages and book appointments (see doctors/triage.py)
+    """
+    patient = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='triage_entry'
+    )
+    # Most recent pain scale the patient reported in chat, and when
+    latest_pain_scale = models.PositiveSmallIntegerField(null=True, blank=True)
+    pain_reported_at = models.DateTimeField(null=True, blank=True)
+    # Last message sent or appointment booked
+    last_activity_at = models.DateTimeField()
+    has_pending_appointment = models.BooleanField(default=False)
+    priority = models.FloatField()
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-priority']
+        indexes = [
+            models.Index(fields=['-priority'], name='triage_priority_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Triage: {self.patient.username} ({self.priority:.1f})"
@@ -1,7 +1,7 @@
 # doctors/serializers.py
 
 from rest_framework import serializers
-from .models import DoctorProfile, Appointment
+from .models import DoctorProfile, Appointment, TriageEntry
 
 
 class DoctorProfileSerializer(serializers.ModelSerializer):
@@ -26,4 +26,15 @@ class AppointmentSerializer(serializers.ModelSerializer):
         model = Appointment
         fields = ['id', 'patient', 'doctor', 'doctor_name', 'patient_name',
                  'appointment_time', 'reason', 'status', 'created_at', 'updated_at']
-        read_only_fields = ['id', 'created_at', 'updated_at']
\ No newline at end of file
+        read_only_fields = ['id', 'created_at', 'updated_at']
+
+
+class TriageEntrySerializer(serializers.ModelSerializer):
+    """Serializer for the TriageEntry model"""
+    patient_name = serializers.CharField(source='patient.get_full_name', read_only=True)
+    
+    class Meta:
+        model = TriageEntry
+        fields = ['patient', 'patient_name', 'latest_pain_scale', 'pain_reported_at',
+                 'last_activity_at', 'has_pending_appointment', 'priority']
+        read_only_fields = fields
@@ -0,0 +1,51 @@
+# doctors/signals.py
+
+from functools import partial
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from chatbot.models import ChatSession, Message
+from chatbot.signals import deleted_directly
+from .models import Appointment
+from . import triage
+
+
+@receiver(post_save, sender=Message)
+def update_triage_for_message(sender, instance, created, raw=False, **kwargs):
+    """Re-rank the patient in the triage queue when they send or edit a message"""
+    if raw:
+        return
+    if created:
+        triage.record_message(instance)
+    else:
+        # An edit may change the pain scale, so rebuild the patient's entry
+        triage.rebuild_entries(user_ids=[instance.chat_session.user_id])
+
+
+@receiver(post_delete, sender=Message)
+def update_triage_for_deleted_message(sender, instance, origin=None, **kwargs):
+    # Messages deleted along with their session are handled per session below
+    if instance.message_type == 'user' and deleted_directly(origin, Message):
+        triage.rebuild_entries(user_ids=[instance.chat_session.user_id])
+
+
+@receiver(post_delete, sender=ChatSession)
+def update_triage_for_deleted_session(sender, instance, origin=None, **kwargs):
+    # A deleted patient's entry is deleted with them. Sessions on other shards
+    # are deleted while the patient is, so wait until that has committed
+    # rather than recreate the entry from their pending appointments.
+    if not isinstance(origin, get_user_model()):
+        transaction.on_commit(partial(triage.rebuild_entries, user_ids=[instance.user_id]), using='default')
+
+
+@receiver(post_save, sender=Appointment)
+def update_triage_for_appointment(sender, instance, created, raw=False, **kwargs):
+    """Keep the patient's pending appointment flag current"""
+    if not raw:
+        triage.record_appointment(instance, created=created)
+
+
+@receiver(post_delete, sender=Appointment)
+def update_triage_for_deleted_appointment(sender, instance, **kwargs):
+    triage.record_appointment(instance)
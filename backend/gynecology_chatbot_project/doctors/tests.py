@@ -0,0 +1,193 @@
+# doctors/tests.py
+
+from datetime import timedelta
+from unittest import mock
+from django.core.cache import cache
+from django.db.models import QuerySet
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from chatbot.models import ChatSession
+from chatbot.sharding import set_shard, shard_for_user
+from doctors.models import Appointment, DoctorProfile, TriageEntry
+from doctors.triage import rebuild_entries
+from users.models import User
+
+
+@override_settings(DATABASE_REPLICAS=[], TRIAGE_PAIN_WEIGHT_HOURS=12, TRIAGE_PENDING_APPOINTMENT_WEIGHT_HOURS=24)
+class TriageQueueTests(TestCase):
+    """The triage queue follows patients' messages and appointments"""
+    databases = {'default', 'chat_shard_1', 'chat_shard_2'}
+    
+    def setUp(self):
+        cache.clear()
+        self.now = timezone.now()
+        self.doctor = User.objects.create_user('doctor', password='secret', user_type='doctor')
+        self.profile = DoctorProfile.objects.create(
+            user=self.doctor, specialization='Gynecology', qualification='MD', experience_years=10, bio=''
+        )
+    
+    def patient(self, username, shard=None):
+        user = User.objects.create_user(username, password='secret')
+        if shard:
+            set_shard(user, shard)
+        user.chat = ChatSession.objects.using(shard_for_user(user)).create(user=user, title='Cramps')
+        return user
+    
+    def book(self, patient, doctor_profile=None, status='pending'):
+        return Appointment.objects.create(
+            patient=patient,
+            doctor=doctor_profile or self.profile,
+            appointment_time=self.now + timedelta(days=1),
+            reason='Pain',
+            status=status
+        )
+    
+    def say(self, patient, pain_scale=None, hours_ago=0):
+        return patient.chat.messages.create(
+            message_type='user',
+            text='It hurts',
+            pain_scale=pain_scale,
+            timestamp=self.now - timedelta(hours=hours_ago)
+        )
+    
+    def queue(self, user, **params):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client.get('/api/triage/', params)
+    
+    def ranking(self):
+        return list(TriageEntry.objects.values_list('patient__username', flat=True))
+    
+    def entries(self):
+        return list(TriageEntry.objects.values_list(
+            'patient_id', 'latest_pain_scale', 'pain_reported_at', 'last_activity_at',
+            'has_pending_appointment', 'priority'
+        ))
+    
+    def test_pain_and_recency_rank_patients(self):
+        mild, severe, quiet = self.patient('mild'), self.patient('severe'), self.patient('quiet')
+        self.say(mild, 2)
+        self.say(severe, 8, hours_ago=24)
+        self.say(quiet, hours_ago=1)
+        self.assertEqual(self.ranking(), ['severe', 'mild', 'quiet'])
+    
+    def test_old_pain_score_fades(self):
+        old_pain, new_pain = self.patient('old_pain', 'chat_shard_1'), self.patient('new_pain')
+        self.say(old_pain, 10, hours_ago=24 * 30)
+        self.say(old_pain)
+        self.say(new_pain, 3, hours_ago=1)
+        
+        self.assertEqual(self.ranking(), ['new_pain', 'old_pain'])
+        entry = TriageEntry.objects.get(patient=old_pain)
+        self.assertEqual(entry.latest_pain_scale, 10)
+        self.assertAlmostEqual(entry.priority, self.now.timestamp() / 3600)
+    
+    def test_pending_appointment_raises_priority_until_cancelled(self):
+        waiting, chatting = self.patient('waiting'), self.patient('chatting')
+        self.say(waiting, 2, hours_ago=10)
+        self.say(chatting, 2)
+        appointment = self.book(waiting)
+        self.assertEqual(self.ranking(), ['waiting', 'chatting'])
+        
+        appointment.status = 'cancelled'
+        appointment.save()
+        self.assertFalse(TriageEntry.objects.get(patient=waiting).has_pending_appointment)
+    
+    def test_entries_follow_message_edits_and_deletes(self):
+        patient = self.patient('patient')
+        message = self.say(patient, 9)
+        self.say(patient, 4, hours_ago=2)
+        
+        message.pain_scale = 1
+        message.save()
+        self.assertEqual(TriageEntry.objects.get(patient=patient).latest_pain_scale, 1)
+        
+        message.delete()
+        self.assertEqual(TriageEntry.objects.get(patient=patient).latest_pain_scale, 4)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            patient.chat.delete()
+        self.assertFalse(TriageEntry.objects.filter(patient=patient).exists())
+    
+    def test_concurrent_first_messages_share_one_entry(self):
+        patient = self.patient('p1')
+        self.say(patient, pain_scale=3, hours_ago=1)
+        
+        # The second message's lookup ran before the first one's entry was committed
+        real_get = QuerySet.get
+        missed = []
+        def get(queryset, *args, **kwargs):
+            if queryset.model is TriageEntry and not missed:
+                missed.append(True)
+                raise TriageEntry.DoesNotExist
+            return real_get(queryset, *args, **kwargs)
+        
+        with mock.patch.object(QuerySet, 'get', get):
+            self.say(patient, pain_scale=7)
+        
+        self.assertEqual(missed, [True])
+        entry = TriageEntry.objects.get()
+        self.assertEqual((entry.patient_id, entry.latest_pain_scale), (patient.id, 7))
+        self.assertEqual(entry.last_activity_at, self.now)
+    
+    def test_rebuild_matches_live_updates(self):
+        first, second = self.patient('first', 'chat_shard_1'), self.patient('second', 'chat_shard_2')
+        self.say(first, 6, hours_ago=5)
+        self.say(first, hours_ago=1)
+        self.say(second, 3, hours_ago=3)
+        self.book(second)
+        self.book(self.patient('booked_only'))
+        live = self.entries()
+        
+        self.assertEqual(rebuild_entries(), 3)
+        self.assertEqual(self.entries(), live)
+    
+    def test_deleting_patient_on_another_shard_removes_entry(self):
+        patient = self.patient('patient', 'chat_shard_1')
+        self.say(patient, 5)
+        self.book(patient)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            patient.delete()
+        self.assertFalse(TriageEntry.objects.exists())
+    
+    def test_doctors_only_see_their_patients(self):
+        other_doctor = User.objects.create_user('other', password='secret', user_type='doctor')
+        other_profile = DoctorProfile.objects.create(
+            user=other_doctor, specialization='Gynecology', qualification='MD', experience_years=5, bio=''
+        )
+        mine, theirs = self.patient('mine'), self.patient('theirs')
+        for patient in (mine, theirs):
+            self.say(patient, 5)
+        self.book(mine)
+        self.book(mine, status='completed')
+        self.book(theirs, other_profile)
+        staff = User.objects.create_user('staff', password='secret', is_staff=True)
+        
+        def names(user):
+            return [entry['patient_name'] for entry in self.queue(user).json()['results']]
+        
+        mine.first_name = 'Mine'
+        mine.save()
+        self.assertEqual(names(self.doctor), ['Mine'])
+        self.assertEqual(len(names(staff)), 2)
+        self.assertEqual(names(mine), [])
+    
+    def test_queue_pages_by_cursor(self):
+        patients = [self.patient(f'patient{i}') for i in range(5)]
+        for hours_ago, patient in enumerate(patients):
+            self.say(patient, 5, hours_ago=hours_ago)
+            self.book(patient)
+        
+        seen = []
+        response = self.queue(self.doctor, limit=2)
+        while True:
+            data = response.json()
+            seen += [entry['patient'] for entry in data['results']]
+            if not data['next']:
+                break
+            client = APIClient()
+            client.force_authenticate(self.doctor)
+            response = client.get(data['next'])
+        self.assertEqual(seen, [patient.id for patient in patients])
@@ -0,0 +1,191 @@
+# doctors/triage.py
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, OuterRef, Subquery
+from chatbot.models import Message
+from .models import Appointment, TriageEntry
+
+
+def compute_priority(latest_pain_scale, pain_reported_at, last_activity_at, has_pending_appointment):
+    """
+    Score a patient for the triage queue; higher is more urgent.
+    
+    Recency is the activity time itself, counted in hours, so newer activity
+    outranks older without entries ever needing to be re-scored as time
+    passes. Each pain point is worth a fixed number of hours on top of the
+    time the pain was reported, not the last activity, so an old pain score
+    fades as newer activity without one overtakes it. A pending appointment
+    adds a fixed number of hours.
+    """
+    priority = hours(last_activity_at)
+    if latest_pain_scale is not None:
+        priority = max(
+            priority,
+            hours(pain_reported_at) + latest_pain_scale * settings.TRIAGE_PAIN_WEIGHT_HOURS
+        )
+    if has_pending_appointment:
+        priority += settings.TRIAGE_PENDING_APPOINTMENT_WEIGHT_HOURS
+    return priority
+
+
+def hours(moment):
+    return moment.timestamp() / 3600
+
+
+def record_message(message):
+    """Move the patient up the queue for a new user message"""
+    if message.message_type != 'user':
+        return
+    
+    patient_id = message.chat_session.user_id
+    with transaction.atomic(using='default'):
+        entry = locked_entry(patient_id, {
+            'last_activity_at': message.timestamp,
+            'has_pending_appointment': has_pending_appointment(patient_id),
+        })
+        
+        # Messages can arrive out of order (e.g. imports); keep the newest report
+        if message.pain_scale not in (None, '') and (
+            entry.pain_reported_at is None or message.timestamp >= entry.pain_reported_at
+        ):
+            entry.latest_pain_scale = int(message.pain_scale)
+            entry.pain_reported_at = message.timestamp
+        entry.last_activity_at = max(
+            message.timestamp,
+            entry.last_activity_at or message.timestamp
+        )
+        save_entry(entry)
+
+
+def record_appointment(appointment, created=False):
+    """Update the patient's pending appointment flag, counting a booking as activity"""
+    patient_id = appointment.patient_id
+    with transaction.atomic(using='default'):
+        if created:
+            entry = locked_entry(patient_id, {'last_activity_at': appointment.created_at})
+        else:
+            entry = TriageEntry.objects.select_for_update().filter(patient_id=patient_id).first()
+            if entry is None:
+                return
+        
+        entry.has_pending_appointment = has_pending_appointment(patient_id)
+        if created:
+            entry.last_activity_at = max(
+                appointment.created_at,
+                entry.last_activity_at or appointment.created_at
+            )
+        save_entry(entry)
+
+
+def locked_entry(patient_id, defaults):
+    """
+    Return the patient's entry locked for update, creating it first if there
+    is none. get_or_create falls back to fetching the row when a concurrent
+    request inserted it first, so two first messages from a new patient
+    don't both try to insert an entry.
+    """
+    entry, created = TriageEntry.objects.get_or_create(
+        patient_id=patient_id,
+        defaults={**defaults, 'priority': 0}
+    )
+    if created:
+        # The insert already holds the row lock until the transaction ends
+        return entry
+    return TriageEntry.objects.select_for_update().get(patient_id=patient_id)
+
+
+def has_pending_appointment(patient_id):
+    return Appointment.objects.filter(patient_id=patient_id, status='pending').exists()
+
+
+def save_entry(entry):
+    entry.priority = compute_priority(
+        entry.latest_pain_scale,
+        entry.pain_reported_at,
+        entry.last_activity_at,
+        entry.has_pending_appointment
+    )
+    entry.save()
+
+
+def rebuild_entries(user_ids=None, batch_size=1000):
+    """
+    Recompute the triage queue, or only the given patients' entries, from the
+    chat shards and appointments. Returns the number of entries written.
+    """
+    appointments = Appointment.objects.all()
+    messages = Message.objects.filter(message_type='user')
+    stale = TriageEntry.objects.all()
+    if user_ids is not None:
+        appointments = appointments.filter(patient_id__in=user_ids)
+        messages = messages.filter(chat_session__user_id__in=user_ids)
+        stale = stale.filter(patient_id__in=user_ids)
+    
+    pending = set(appointments.filter(status='pending').values_list('patient_id', flat=True))
+    latest_pain = (
+        Message.objects
+        .filter(
+            chat_session__user_id=OuterRef('chat_session__user_id'),
+            message_type='user',
+            pain_scale__isnull=False
+        )
+        .order_by('-timestamp')
+    )
+    
+    entries = {}
+    # Every user's messages live on exactly one shard
+    for alias in settings.CHAT_SHARDS:
+        rows = (
+            messages
+            .using(alias)
+            .values('chat_session__user_id')
+            .annotate(
+                last_activity_at=Max('timestamp'),
+                latest_pain_scale=Subquery(latest_pain.values('pain_scale')[:1]),
+                pain_reported_at=Subquery(latest_pain.values('timestamp')[:1])
+            )
+            .order_by()
+        )
+        for row in rows.iterator(chunk_size=batch_size):
+            patient_id = row['chat_session__user_id']
+            entries[patient_id] = TriageEntry(
+                patient_id=patient_id,
+                latest_pain_scale=row['latest_pain_scale'],
+                pain_reported_at=row['pain_reported_at'],
+                last_activity_at=row['last_activity_at'],
+                has_pending_appointment=patient_id in pending
+            )
+    
+    # Bookings count as activity; patients who booked but never chatted are
+    # only queued while an appointment is pending
+    bookings = (
+        appointments
+        .values('patient_id')
+        .annotate(last_activity_at=Max('created_at'))
+        .order_by()
+    )
+    for row in bookings.iterator(chunk_size=batch_size):
+        entry = entries.get(row['patient_id'])
+        if entry is not None:
+            entry.last_activity_at = max(entry.last_activity_at, row['last_activity_at'])
+        elif row['patient_id'] in pending:
+            entries[row['patient_id']] = TriageEntry(
+                patient_id=row['patient_id'],
+                last_activity_at=row['last_activity_at'],
+                has_pending_appointment=True
+            )
+    
+    for entry in entries.values():
+        entry.priority = compute_priority(
+            entry.latest_pain_scale,
+            entry.pain_reported_at,
+            entry.last_activity_at,
+            entry.has_pending_appointment
+        )
+    
+    with transaction.atomic(using='default'):
+        stale.delete()
+        TriageEntry.objects.bulk_create(entries.values(), batch_size=batch_size)
+    
+    return len(entries)
@@ -1,19 +1,21 @@
 # doctors/views.py
 
 from rest_framework import viewsets, permissions
+from rest_framework.pagination import CursorPagination
 from rest_framework.permissions import IsAuthenticated
-from .models import DoctorProfile, Appointment
-from .serializers import DoctorProfileSerializer, AppointmentSerializer
+from gynecology_chatbot_project.db_routers import ReplicaReadsMixin
+from .models import DoctorProfile, Appointment, TriageEntry
+from .serializers import DoctorProfileSerializer, AppointmentSerializer, TriageEntrySerializer
 
 
-class DoctorProfileViewSet(viewsets.ReadOnlyModelViewSet):
+class DoctorProfileViewSet(ReplicaReadsMixin, viewsets.ReadOnlyModelViewSet):
     """View doctor profiles (read-only)"""
     queryset = DoctorProfile.objects.all()
     serializer_class = DoctorProfileSerializer
     permission_classes = [IsAuthenticated]
 
 
-class AppointmentViewSet(viewsets.ModelViewSet):
+class AppointmentViewSet(ReplicaReadsMixin, viewsets.ModelViewSet):
     """Manage appointments in the database"""
     serializer_class = AppointmentSerializer
     permission_classes = [IsAuthenticated]
@@ -33,4 +35,35 @@ class AppointmentViewSet(viewsets.ModelViewSet):
     
     def perform_create(self, serializer):
         """Create a new appointment"""
-        serializer.save(patient=self.request.user)
\ No newline at end of file
+        serializer.save(patient=self.request.user)
+
+
+class TriagePagination(CursorPagination):
+    """Keyset pagination over the priority index, so every page costs the same"""
+    ordering = '-priority'
+    page_size = 20
+    page_size_query_param = 'limit'
+    max_page_size = 100
+
+
+class TriageEntryViewSet(ReplicaReadsMixin, viewsets.ReadOnlyModelViewSet):
+    """View the patient triage queue, most urgent first (doctors and staff only)"""
+    serializer_class = TriageEntrySerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = TriagePagination
+    
+    def get_queryset(self):
+        """
+        Return the whole queue for staff and, like the pain trends, only the
+        patients who have an appointment with them for doctors
+        """
+        user = self.request.user
+        queryset = TriageEntry.objects.select_related('patient')
+        
+        if user.is_staff:
+            return queryset
+        if user.user_type == 'doctor':
+            return queryset.filter(
+                patient__in=Appointment.objects.filter(doctor__user=user).values('patient')
+            )
+        return TriageEntry.objects.none()
\ No newline at end of file
@@ -0,0 +1,60 @@
+# gynecology_chatbot_project/middleware.py
+
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+from django.utils.regex_helper import _lazy_re_compile
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; responses are then gzip-compressed only
+    brotli = None
+
+re_accepts_brotli = _lazy_re_compile(r'\bbr\b')
+
+# Content types that are already compressed and would not shrink any further
+COMPRESSED_CONTENT_TYPES = ('application/zip', 'application/gzip')
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    Compress responses with brotli when the client accepts it (and the brotli
+    package is installed), otherwise with gzip. Responses smaller than
+    RESPONSE_COMPRESSION_MIN_SIZE bytes are sent as-is, since compressing them
+    costs more CPU than it saves on the wire.
+    """
+    
+    def process_response(self, request, response):
+        if response.get('Content-Type', '').startswith(COMPRESSED_CONTENT_TYPES):
+            return response
+        
+        if not response.streaming and len(response.content) < settings.RESPONSE_COMPRESSION_MIN_SIZE:
+            return response
+        
+        if (
+            brotli is None
+            or response.streaming
+            or response.has_header('Content-Encoding')
+            or not re_accepts_brotli.search(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        ):
+            return super().process_response(request, response)
+        
+        patch_vary_headers(response, ('Accept-Encoding',))
+        
+        compressed_content = brotli.compress(
+            response.content,
+            quality=settings.RESPONSE_COMPRESSION_BROTLI_QUALITY
+        )
+        # Return the compressed content only if it's actually shorter
+        if len(compressed_content) >= len(response.content):
+            return response
+        response.content = compressed_content
+        response.headers['Content-Length'] = str(len(response.content))
+        
+        # A compressed representation can't carry the strong ETag of the original
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = 'br'
+        
+        return response
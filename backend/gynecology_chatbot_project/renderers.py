@@ -0,0 +1,59 @@
+# gynecology_chatbot_project/renderers.py
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser, JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the stdlib json module
+    orjson = None
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    JSON renderer backed by orjson, which serializes several times faster than
+    the stdlib encoder used by DRF's JSONRenderer. Falls back to JSONRenderer
+    when orjson is not installed or an indented response was requested.
+    """
+    options = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS if orjson else 0
+    
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        
+        if data is None:
+            return b''
+        
+        # DRF's encoder handles the types orjson doesn't (Decimal, lazy strings, ...)
+        ret = orjson.dumps(data, default=JSONEncoder().default, option=self.options)
+        
+        # Escape the line and paragraph separators like JSONRenderer does, as
+        # they are valid in JSON but not in JavaScript string literals
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+class ORJSONParser(JSONParser):
+    """JSON parser backed by orjson, falling back to JSONParser without it"""
+    renderer_class = ORJSONRenderer
+    
+    def parse(self, stream, media_type=None, parser_context=None):
+        if orjson is None:
+            return super().parse(stream, media_type, parser_context)
+        
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError(f'JSON parse error - {exc}')
+
+
+class NDJSONParser(BaseParser):
+    """
+    Parser for newline-delimited JSON bodies. Returns an iterator over the raw
+    lines so large uploads can be processed without loading them into memory.
+    """
+    media_type = 'application/x-ndjson'
+    
+    def parse(self, stream, media_type=None, parser_context=None):
+        return iter(stream.readline, b'')
@@ -2,6 +2,7 @@
 
 import os
 from pathlib import Path
+from corsheaders.defaults import default_headers
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -36,10 +37,12 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'gynecology_chatbot_project.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'gynecology_chatbot_project.db_routers.ReplicaPinningMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -65,18 +68,90 @@ TEMPLATES = [
 WSGI_APPLICATION = 'gynecology_chatbot_project.wsgi.application'
 
 # Database
-# We'll use PostgreSQL as it's optimal for Django and handles structured data well
-DATABASES = {
-    'default': {
+# We'll use PostgreSQL as it's optimal for Django and handles structured data well.
+# Writes always go to 'default'; safe reads can be spread over read replicas
+# listed in DB_REPLICA_HOSTS (see gynecology_chatbot_project/db_routers.py).
+def database_config(host, port, conn_max_age):
+    """Return a PostgreSQL connection config for one database alias"""
+    return {
         'ENGINE': 'django.db.backends.postgresql',
         'NAME': os.getenv('DB_NAME', 'gynecology_chatbot'),
         'USER': os.getenv('DB_USER', 'postgres'),
         'PASSWORD': os.getenv('DB_PASSWORD', ''),
-        'HOST': os.getenv('DB_HOST', 'localhost'),
-        'PORT': os.getenv('DB_PORT', '5432'),
+        'HOST': host,
+        'PORT': port,
+        # Persistent connections: seconds to keep a connection open, 0 closes
+        # it after each request and None keeps it open indefinitely.
+        'CONN_MAX_AGE': conn_max_age,
+        'CONN_HEALTH_CHECKS': conn_max_age != 0,
     }
+
+
+def conn_max_age_setting(name, default='0'):
+    """Parse a CONN_MAX_AGE environment variable ('none' means unlimited)"""
+    value = os.getenv(name, default)
+    return None if value.lower() == 'none' else int(value)
+
+
+DATABASES = {
+    'default': database_config(
+        os.getenv('DB_HOST', 'localhost'),
+        os.getenv('DB_PORT', '5432'),
+        conn_max_age_setting('DB_CONN_MAX_AGE'),
+    )
 }
 
+DATABASE_REPLICAS = []
+for index, replica in enumerate(filter(None, os.getenv('DB_REPLICA_HOSTS', '').split(',')), start=1):
+    replica_host, _, replica_port = replica.strip().partition(':')
+    alias = f'replica_{index}'
+    DATABASES[alias] = database_config(
+        replica_host,
+        replica_port or os.getenv('DB_PORT', '5432'),
+        conn_max_age_setting('DB_REPLICA_CONN_MAX_AGE', os.getenv('DB_CONN_MAX_AGE', '0')),
+    )
+    # Replicas share the primary's data, so tests should not create them separately
+    DATABASES[alias]['TEST'] = {'MIRROR': 'default'}
+    DATABASE_REPLICAS.append(alias)
+
+# Chat data (the chatbot app) is sharded by user across 'default' and the
+# databases listed in DB_CHAT_SHARD_HOSTS (see chatbot/sharding.py)
+CHAT_SHARDS = ['default']
+for index, shard in enumerate(filter(None, os.getenv('DB_CHAT_SHARD_HOSTS', '').split(',')), start=1):
+    shard_host, _, shard_port = shard.strip().partition(':')
+    alias = f'chat_shard_{index}'
+    DATABASES[alias] = database_config(
+        shard_host,
+        shard_port or os.getenv('DB_PORT', '5432'),
+        conn_max_age_setting('DB_CONN_MAX_AGE'),
+    )
+    CHAT_SHARDS.append(alias)
+
+# Seconds a user's shard lookup is cached
+CHAT_SHARD_CACHE_SECONDS = int(os.getenv('CHAT_SHARD_CACHE_SECONDS', '300'))
+
+DATABASE_ROUTERS = [
+    'gynecology_chatbot_project.db_routers.ChatShardRouter',
+    'gynecology_chatbot_project.db_routers.PrimaryReplicaRouter',
+]
+
+# Apps whose reads may be served by a replica (sessions, auth and tokens stay on the primary)
+DATABASE_REPLICA_APPS = ['chatbot', 'doctors']
+
+# Seconds a user stays pinned to the primary after a write, so they read their own writes
+DATABASE_REPLICA_PIN_SECONDS = int(os.getenv('DB_REPLICA_PIN_SECONDS', '5'))
+
+# Replica pins and shard lookups are kept in the cache. Every app server and
+# management command must share it, so set REDIS_URL whenever more than one
+# process serves the API (the default local-memory cache is per process).
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+
 AUTH_USER_MODEL = 'users.User'
 
 # Password validation
@@ -101,6 +176,8 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # CORS settings
 CORS_ALLOW_ALL_ORIGINS = True  # Adjust for production
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key')
+CORS_EXPOSE_HEADERS = ['Idempotent-Replayed']
 
 # Rest Framework settings
 REST_FRAMEWORK = {
@@ -110,16 +187,45 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
-    ]
+    ],
+    # orjson-backed JSON (falls back to the stdlib encoder if orjson is missing)
+    'DEFAULT_RENDERER_CLASSES': [
+        'gynecology_chatbot_project.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'gynecology_chatbot_project.renderers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
 
+# Response compression (brotli if installed and accepted, gzip otherwise)
+RESPONSE_COMPRESSION_MIN_SIZE = int(os.getenv('RESPONSE_COMPRESSION_MIN_SIZE', '1024'))
+RESPONSE_COMPRESSION_BROTLI_QUALITY = int(os.getenv('RESPONSE_COMPRESSION_BROTLI_QUALITY', '5'))
+
 # OAuth settings
 OAUTH2_PROVIDER = {
     'SCOPES': {'read': 'Read scope', 'write': 'Write scope'},
     'ACCESS_TOKEN_EXPIRE_SECONDS': 60 * 60 * 24 * 7,  # 1 week
 }
 
+# send_message idempotency: how long keys are remembered, and how long a retry
+# waits for the original request (e.g. a slow AI provider) before giving up. A
+# key whose request hasn't finished after that long is taken over by the next
+# retry, so a worker killed mid-request doesn't block the key until it expires
+IDEMPOTENCY_KEY_TTL_HOURS = int(os.getenv('IDEMPOTENCY_KEY_TTL_HOURS', '24'))
+IDEMPOTENCY_WAIT_SECONDS = int(os.getenv('IDEMPOTENCY_WAIT_SECONDS', '30'))
+
+# Doctor triage queue: how many hours of recency each pain scale point and a
+# pending appointment are worth when ranking patients
+TRIAGE_PAIN_WEIGHT_HOURS = int(os.getenv('TRIAGE_PAIN_WEIGHT_HOURS', '12'))
+TRIAGE_PENDING_APPOINTMENT_WEIGHT_HOURS = int(os.getenv('TRIAGE_PENDING_APPOINTMENT_WEIGHT_HOURS', '24'))
+
 # API Keys for AI services
 CHATGPT_API_KEY = os.getenv('CHATGPT_API_KEY', '')
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY', '')
-GROK_API_KEY = os.getenv('GROK_API_KEY', '')
\ No newline at end of file
+GROK_API_KEY = os.getenv('GROK_API_KEY', '')
+# Seconds to wait on each AI provider; all three together should stay under
+# IDEMPOTENCY_WAIT_SECONDS, or a retry may take over a request still running
+AI_PROVIDER_TIMEOUT_SECONDS = int(os.getenv('AI_PROVIDER_TIMEOUT_SECONDS', '8'))
\ No newline at end of file
@@ -0,0 +1,35 @@
+# gynecology_chatbot_project/test_settings.py
+#
+# Settings for the automated tests: SQLite databases standing in for the
+# primary, a read replica and two chat shards, so routing and sharding can be
+# tested without PostgreSQL. Run with
+#   python manage.py test --settings=gynecology_chatbot_project.test_settings
+
+from .settings import *  # noqa: F401,F403
+from .settings import INSTALLED_APPS
+
+
+def sqlite_config(name):
+    # Test databases are created in memory
+    return {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / f'{name}.sqlite3'}  # noqa: F405
+
+
+DATABASES = {
+    'default': sqlite_config('default'),
+    'replica_1': {**sqlite_config('replica_1'), 'TEST': {'MIRROR': 'default'}},
+    'chat_shard_1': sqlite_config('chat_shard_1'),
+    'chat_shard_2': sqlite_config('chat_shard_2'),
+}
+DATABASE_REPLICAS = ['replica_1']
+CHAT_SHARDS = ['default', 'chat_shard_1', 'chat_shard_2']
+
+# Create tables straight from the models; the apps ship without migrations
+MIGRATION_MODULES = {app.rsplit('.', 1)[-1]: None for app in INSTALLED_APPS}
+
+# A single test process doesn't need a shared cache
+CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+SILENCED_SYSTEM_CHECKS = ['chatbot.W001']
+PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+# Never call the real AI providers
+CHATGPT_API_KEY = GEMINI_API_KEY = GROK_API_KEY = ''
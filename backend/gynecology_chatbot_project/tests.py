@@ -0,0 +1,135 @@
+# gynecology_chatbot_project/tests.py
+
+import unittest
+from unittest import mock
+from django.core.cache import cache
+from django.db import connections, router
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from chatbot.models import ChatSession
+from chatbot.serializers import ChatSessionValuesSerializer
+from users.models import User
+from .db_routers import is_pinned, pin_to_primary, reset_routing, use_replicas
+from .renderers import ORJSONRenderer, orjson
+
+
+@override_settings(CHAT_SHARDS=['default'])
+class ReplicaRoutingTests(TransactionTestCase):
+    """
+    Reads and writes are routed between the primary and the replica. The
+    replica mirrors the primary's in-memory test database, which only shows
+    committed data, hence TransactionTestCase.
+    """
+    databases = {'default', 'replica_1'}
+    
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('patient', password='secret')
+        self.session = ChatSession.objects.create(user=self.user, title='Cramps')
+        # A client without cookies, authenticated the way bearer tokens are
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+    
+    def tearDown(self):
+        reset_routing()
+    
+    def chat_queries(self, alias, request):
+        """Run a request and return the chatbot queries it sent to a database"""
+        with CaptureQueriesContext(connections[alias]) as queries:
+            response = request()
+        return response, [q['sql'] for q in queries.captured_queries if 'chatbot_' in q['sql']]
+    
+    def test_router_sends_reads_to_replica_only_when_enabled(self):
+        self.assertEqual(ChatSession.objects.all().db, 'default')
+        use_replicas()
+        self.assertEqual(ChatSession.objects.all().db, 'replica_1')
+    
+    def test_router_sends_writes_and_later_reads_to_primary(self):
+        use_replicas()
+        self.assertEqual(router.db_for_write(ChatSession), 'default')
+        pin_to_primary()
+        self.assertEqual(ChatSession.objects.all().db, 'default')
+    
+    def test_auth_data_is_never_read_from_replica(self):
+        use_replicas()
+        self.assertEqual(User.objects.all().db, 'default')
+    
+    def test_safe_request_reads_from_replica(self):
+        response, replica_queries = self.chat_queries(
+            'replica_1', lambda: self.client.get('/api/chat-sessions/')
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(replica_queries)
+    
+    def test_write_request_uses_primary(self):
+        _, replica_queries = self.chat_queries(
+            'replica_1',
+            lambda: self.client.post('/api/chat-sessions/', {'title': 'New', 'user': self.user.id}, format='json')
+        )
+        self.assertEqual(replica_queries, [])
+        self.assertTrue(ChatSession.objects.using('default').filter(title='New').exists())
+    
+    def test_reads_stay_on_primary_while_pinned(self):
+        response = self.client.post(
+            f'/api/chat-sessions/{self.session.id}/messages/',
+            {'text': 'It hurts', 'message_type': 'user'},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(is_pinned(self.user.id))
+        
+        # The pin is kept on the server, not in a cookie the client must return
+        self.client.cookies.clear()
+        response, replica_queries = self.chat_queries(
+            'replica_1', lambda: self.client.get(f'/api/chat-sessions/{self.session.id}/messages/')
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(replica_queries, [])
+        self.assertEqual(len(response.json()), 1)
+    
+    def test_pin_only_applies_to_the_writer(self):
+        self.client.post('/api/chat-sessions/', {'title': 'New', 'user': self.user.id}, format='json')
+        
+        other = User.objects.create_user('other', password='secret')
+        client = APIClient()
+        client.force_authenticate(other)
+        _, replica_queries = self.chat_queries('replica_1', lambda: client.get('/api/chat-sessions/'))
+        self.assertTrue(replica_queries)
+    
+    def test_session_list_reads_sessions_and_messages_from_one_database(self):
+        self.session.messages.create(message_type='user', text='It hurts')
+        use_replicas()
+        
+        # With several replicas each routing decision may pick a different one
+        with mock.patch.object(router, 'db_for_read', wraps=router.db_for_read) as db_for_read:
+            data = ChatSessionValuesSerializer(ChatSession.objects.filter(user=self.user)).data
+        
+        self.assertEqual(len(data[0]['messages']), 1)
+        self.assertEqual(db_for_read.call_count, 1)
+    
+    def test_pin_expires(self):
+        self.client.post('/api/chat-sessions/', {'title': 'New', 'user': self.user.id}, format='json')
+        cache.clear()
+        _, replica_queries = self.chat_queries(
+            'replica_1', lambda: self.client.get('/api/chat-sessions/')
+        )
+        self.assertTrue(replica_queries)
+
+
+@unittest.skipIf(orjson is None, 'orjson is not installed')
+class ORJSONRendererTests(SimpleTestCase):
+    """The orjson renderer produces the same bytes as DRF's JSONRenderer"""
+    
+    def test_matches_json_renderer(self):
+        data = [{
+            'id': 1,
+            'message_type': 'user',
+            'text': 'Line\u2028and paragraph\u2029separators, "quotes", caf\u00e9 \U0001f600',
+            'timestamp': '2025-03-01T12:00:00Z',
+            'pain_scale': None,
+            'ai_provider': '',
+        }]
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertIn(b'\\u2028', ORJSONRenderer().render(data))
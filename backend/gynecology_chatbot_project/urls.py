@@ -4,14 +4,15 @@ from django.contrib import admin
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from users.views import UserViewSet
-from chatbot.views import ChatSessionViewSet, MessageViewSet
-from doctors.views import DoctorProfileViewSet, AppointmentViewSet
+from chatbot.views import ChatSessionViewSet, MessageViewSet, PainTrendViewSet
+from doctors.views import DoctorProfileViewSet, AppointmentViewSet, TriageEntryViewSet
 
 router = DefaultRouter()
 router.register('users', UserViewSet)
 router.register('chat-sessions', ChatSessionViewSet, basename='chat-sessions')
 router.register('doctors', DoctorProfileViewSet)
 router.register('appointments', AppointmentViewSet, basename='appointments')
+router.register('triage', TriageEntryViewSet, basename='triage')
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -22,5 +23,8 @@ urlpatterns = [
     path('api/chat-sessions/<int:chat_session_id>/send-message/',
          MessageViewSet.as_view({'post': 'send_message'}),
          name='send-message'),
+    path('api/patients/<int:patient_id>/pain-trend/',
+         PainTrendViewSet.as_view({'get': 'list'}),
+         name='patient-pain-trend'),
     path('api/auth/', include('oauth2_provider.urls', namespace='oauth2_provider')),
 ]
\ No newline at end of file